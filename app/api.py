@@ -1,15 +1,12 @@
-import os
-from datetime import datetime
-
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404
-from django.core.files import File
-from django.utils.timezone import make_aware
+from django.urls import reverse
 
-from dashboard_racks import settings
-from .models import Rack, ReportArchive, Report
-from .utils.paramiko_wrapper import SftpApi, get_sftp_instance_by_hostname
+from .counts import invalidate_report_counts
+from .ingest import start_archive_job, get_archive_job, get_archive_job_status
+from .models import Rack, Report, ReportArchive, ReportBlob
 
 
 sftp = None
@@ -20,18 +17,18 @@ def delete_selected_reports(request, rack_pk):
     prefix = 'cb_report_'
     rack = get_object_or_404(Rack, pk=rack_pk)
 
-    reports = []
+    pks = []
     for k, v in request.POST.items():
         if prefix in k and v == 'on':
-            pk = int(k.replace(prefix, ''))
-            report = Report.objects.get(pk=pk)
-            reports.append(report)
+            pks.append(int(k.replace(prefix, '')))
 
-    for report in reports:
-        file_path = os.path.join(settings.MEDIA_ROOT, report.file.name)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        report.delete()
+    with transaction.atomic():
+        reports = list(Report.objects.filter(pk__in=pks))
+        ReportBlob.remove_references([report.file.name for report in reports])
+        Report.objects.filter(pk__in=[report.pk for report in reports]).delete()
+        ReportArchive.remove_from_stats(reports)
+        for archive_id in {report.archive_id for report in reports}:
+            transaction.on_commit(lambda archive_id=archive_id: invalidate_report_counts(archive_id))
 
     next = request.GET.get('next', '/')
     return HttpResponseRedirect(next)
@@ -39,53 +36,29 @@ def delete_selected_reports(request, rack_pk):
 
 def archive_reports(request, rack_pk):
     rack = get_object_or_404(Rack, pk=rack_pk)
-    ssh_config = rack.ssh_config
-    report_config = rack.report_config
-    archive, created = ReportArchive.objects.get_or_create(name=rack.name)
-    if not rack.archive:
-        rack.archive = archive
-        rack.save()
-
-    sftp_api = get_sftp_instance_by_hostname(
-        hostname=ssh_config.hostname,
-        username=ssh_config.username,
-        password=ssh_config.password,
-        private_key=ssh_config.private_key.path if ssh_config.private_key else '',
-        port=ssh_config.port,
-    )
-
-    local_path = settings.MEDIA_ROOT + os.sep + rack.name
-
-    if not sftp_api.is_connected:
-        sftp_api.connect()
-
-    os.makedirs(local_path, exist_ok=True)
-
-    n_moved_files = sftp_api.move_from_remote_by_pattern(
-        remote_dir=report_config.remote_report_path,
-        local_path=local_path,
-        remote_regex='.*\.html',
-    )
-
-    for r in os.listdir(local_path):
-        path = local_path + os.sep + r
-        f = open(path)
-
-        fname = os.path.basename(r).split('_Testresult')[0]
-        dt = datetime.strptime(fname, '%Y-%m-%d_%H-%M-%S')
-        dt = make_aware(dt)
-
-        report: Report = Report.objects.get_or_create(
-            archive=archive,
-            verdict='PASSED' if 'error' not in r.lower() else 'FAILED',
-            created=dt,
-            name=r)[0]
-        report.file.save(name=r, content=File(f), save=False)
-        if os.path.exists(r):
-            os.remove(r)
-        report.save()
-
-    messages.success(request, f'Moved {n_moved_files} files from {ssh_config.hostname} to archive.', extra_tags='success')
+    job_id, joined = start_archive_job(rack)
+
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({
+            'job_id': job_id,
+            'joined': joined,
+            'status_url': reverse('rack-archive-status', kwargs={'rack_pk': rack.pk}) + f'?job={job_id}',
+        }, status=202)
+
+    if joined:
+        messages.success(request, f'Archiving of {rack.ssh_config.hostname} is already running (job {job_id}).',
+                         extra_tags='info')
+    else:
+        messages.success(request, f'Archiving of {rack.ssh_config.hostname} has been queued (job {job_id}).',
+                         extra_tags='success')
 
     next = request.GET.get('next', '/')
     return HttpResponseRedirect(next)
+
+
+def archive_status(request, rack_pk):
+    rack = get_object_or_404(Rack, pk=rack_pk)
+    job_id = request.GET.get('job') or get_archive_job(rack.pk)
+    if job_id is None:
+        return JsonResponse({'job_id': None, 'state': None, 'progress': None, 'error': None})
+    return JsonResponse(get_archive_job_status(job_id))
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_delete
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from .models import ReportArchive, remove_archive_references
+        from .search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
+        pre_delete.connect(remove_archive_references, sender=ReportArchive)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import connection
+
+from dashboard_racks import settings
+from .models import ReportArchive
+
+REPORT_COUNT_KEY = 'report-count-{0}-{1}-{2}'  # archive pk, count version, filter hash
+REPORT_COUNT_VERSION_KEY = 'report-count-version-{0}'
+
+ReportCount = namedtuple('ReportCount', ['value', 'qualifier'])  # qualifier: None for exact counts, 'about', 'more than'
+
+
+def active_filters(filterset):
+    """
+    :return: {filter name: normalized value} of the filters of a bound filterset that are set.
+    """
+    if not filterset.is_bound or not filterset.form.is_valid():
+        return {}
+    return {name: value.isoformat() if hasattr(value, 'isoformat') else str(value)
+            for name, value in filterset.form.cleaned_data.items() if value not in (None, '')}
+
+
+def get_report_count(archive: ReportArchive, filterset):
+    """
+    Counts the reports of an archive that pass the filterset. Unfiltered and verdict only counts are read from the
+    archive statistics. Other counts are cached per archive and filter until the reports of the archive change. In
+    archives with more than REPORT_COUNT_EXACT_LIMIT reports counting stops at the limit and the count is estimated.
+    :return: ReportCount
+    """
+    filters = active_filters(filterset)
+    if not filters:
+        return ReportCount(archive.reports_total, None)
+    if list(filters) == ['verdict'] and filters['verdict'].upper() in ('PASSED', 'FAILED'):
+        return ReportCount(archive.reports_passed if filters['verdict'].upper() == 'PASSED' else archive.reports_failed,
+                           None)
+
+    filter_hash = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    key = REPORT_COUNT_KEY.format(archive.pk, _count_version(archive.pk), filter_hash)
+    count = cache.get(key)
+    if count is None:
+        count = _count(filterset.qs, archive)
+        cache.set(key, count, timeout=settings.REPORT_COUNT_CACHE_TIMEOUT)
+    return ReportCount(*count)
+
+
+def invalidate_report_counts(archive_pk):
+    """
+    Drops the cached report counts of an archive, to be called whenever reports are added to or deleted from it.
+    """
+    key = REPORT_COUNT_VERSION_KEY.format(archive_pk)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def _count_version(archive_pk):
+    return cache.get_or_set(REPORT_COUNT_VERSION_KEY.format(archive_pk), 0, timeout=None)
+
+
+def _count(queryset, archive: ReportArchive):
+    limit = settings.REPORT_COUNT_EXACT_LIMIT
+    if archive.reports_total <= limit:
+        return queryset.count(), None
+
+    n_reports = queryset.order_by()[:limit + 1].count()
+    if n_reports <= limit:
+        return n_reports, None
+    estimate = _planner_estimate(queryset)
+    if estimate is not None and estimate > limit:
+        return estimate, 'about'
+    return limit, 'more than'
+
+
+def _planner_estimate(queryset):
+    """
+    :return: Number of rows the PostgreSQL query planner expects for the queryset. None on other databases.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
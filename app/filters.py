@@ -11,6 +11,7 @@ from django import forms
 from django_filters import DateFilter, CharFilter, ChoiceFilter
 
 from .models import Report, ReportArchive, Rack
+from .search import filter_reports
 from .widgets import XDSoftDateTimePickerInput
 
 
@@ -25,14 +26,24 @@ class ReportFilter(FilterSet):
         lookup_expr='icontains',
         widget=forms.TextInput(attrs={'class': 'form-control'}))
 
+    search = filters.CharFilter(
+        label='Search',
+        method='filter_search',
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Words in the report'}))
+
     verdict = filters.CharFilter(
         label='Verdict',
-        lookup_expr='iexact',
+        method='filter_verdict',
         widget=forms.Select(
             attrs={'class': 'form-control'},
             choices=Report.VERDICT_CHOICES,
         ))
 
+    dut = filters.CharFilter(
+        label='DUT',
+        lookup_expr='iexact',
+        widget=forms.TextInput(attrs={'class': 'form-control'}))
+
     created = filters.DateTimeFilter(
         label='Created From',
         # lookup_expr='gte',
@@ -45,7 +56,7 @@ class ReportFilter(FilterSet):
 
     class Meta:
         model = Report
-        fields = ['name', 'verdict', 'created']
+        fields = ['name', 'search', 'verdict', 'dut', 'created']
         exclude = ['']
         ordering = 'created'
 
@@ -58,11 +69,25 @@ class ReportFilter(FilterSet):
         return _qs
 
     def filter_created(self, qs: QuerySet, name, value):
-        qs_date_gt = qs.filter(created__date__gt=value)
-        qs_date_exact = qs.filter(created__date__exact=value)
-        qs_date_exact_time_gt = qs_date_exact.filter(created__time__gte=value)
-        new_qs = qs_date_gt | qs_date_exact_time_gt
-        return new_qs
+        # plain range on the column, so the (archive, created) indexes can be used
+        return qs.filter(created__gte=value)
+
+    def filter_search(self, qs: QuerySet, name, value):
+        # full-text index of the report content, see app.search
+        return filter_reports(qs, value)
+
+    @property
+    def search_query(self):
+        """
+        :return: The words searched for. None, if the reports are not searched.
+        """
+        if not self.is_bound or not self.form.is_valid():
+            return None
+        return self.form.cleaned_data.get('search') or None
+
+    def filter_verdict(self, qs: QuerySet, name, value):
+        # verdicts are stored upper case, an exact match can use the (archive, verdict, created) index
+        return qs.filter(verdict=value.upper())
 
     def __str__(self):
         self.name
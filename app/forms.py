@@ -112,12 +112,26 @@ class CreateReportConfigForm(forms.ModelForm):
 
     class Meta:
         model = ReportConfig
-        fields = ['remote_report_path', 'pull_reports_time']
+        fields = ['remote_report_path', 'pull_reports_time', 'adaptive_polling', 'min_poll_interval',
+                  'max_poll_interval', 'watch_mode', 'transfer_mode']
 
         widgets = {
             'pull_reports_time': TimePickerInput(),
+            'adaptive_polling': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'min_poll_interval': forms.NumberInput(attrs={'class': 'form-control'}),
+            'max_poll_interval': forms.NumberInput(attrs={'class': 'form-control'}),
+            'watch_mode': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'transfer_mode': forms.Select(attrs={'class': 'form-control'}),
         }
 
+    def clean(self):
+        cleaned_data = super().clean()
+        min_poll_interval = cleaned_data.get('min_poll_interval')
+        max_poll_interval = cleaned_data.get('max_poll_interval')
+        if min_poll_interval is not None and max_poll_interval is not None and min_poll_interval > max_poll_interval:
+            self.add_error('max_poll_interval', 'The maximum poll interval must not be below the minimum.')
+        return cleaned_data
+
     def __str__(self):
         return "CreateReportConfigForm"
 
@@ -0,0 +1,276 @@
+import itertools
+import logging
+import os
+import uuid
+from datetime import datetime
+
+from celery.result import AsyncResult
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils.timezone import make_aware
+
+from dashboard_racks import settings
+from .models import Rack, ReportArchive, Report, ReportBlob
+from .counts import invalidate_report_counts
+from .report_parsers import parse_report
+from .search import index_reports
+from .snapshots import forget_remote_reports
+from .storage import compress_file
+from .utils.paramiko_wrapper import sftp_instance, listing_watermark, DEFAULT_PATH_SEP
+
+ARCHIVE_JOB_KEY = 'archive-job-{0}'
+FULL_LISTING_KEY = 'archive-full-listing-{0}'
+REPORT_PATTERN = r'.*\.html'
+UNPARSABLE_REPORT_NAME = "Skipping report '{0}', its name does not start with a timestamp."
+PLACE_REPORT_ERROR = "Could not move report '{0}' into the report storage, it stays in '{1}': {2}"
+
+logger = logging.getLogger('ingest')
+
+
+def new_progress():
+    return {'listed': 0, 'transferred': 0, 'bytes': 0, 'rows_written': 0}
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def archive_reports(rack: Rack, progress=None, report_names=None):
+    """
+    Moves all reports from the remote report directory of the rack into its archive. Only reports past the listing
+    watermark of the rack are listed, except once every REMOTE_LISTING_FULL_INTERVAL seconds, so reports that show up
+    with an old modification time are archived eventually.
+    :param rack:         Rack whose reports are archived.
+    :param progress:     Optional callable, called with the progress dict whenever it changes.
+    :param report_names: Optional file names of the reports to move, the remote directory is not listed then.
+    :return: Progress dict with the number of files listed and transferred, the transferred bytes and the rows written.
+    """
+    stats = new_progress()
+    report_progress = progress or (lambda _: None)
+
+    archive, created = ReportArchive.objects.get_or_create(name=rack.name)
+    if not rack.archive:
+        rack.archive = archive
+        rack.save()
+
+    local_path = settings.MEDIA_ROOT + os.sep + rack.name
+    os.makedirs(local_path, exist_ok=True)
+    remote_dir = rack.report_config.remote_report_path
+
+    moved = []
+    with sftp_instance(**rack.ssh_config.get_connection_kwargs()) as sftp_api:
+        if report_names is None:
+            full_listing = cache.add(FULL_LISTING_KEY.format(rack.pk), True,
+                                     timeout=settings.REMOTE_LISTING_FULL_INTERVAL)
+            files = sftp_api.list_pattern_on_remote(
+                remote_dir, REPORT_PATTERN, since=None if full_listing else rack.report_config.listing_watermark)
+            names = [f.filename for f in files]
+        else:
+            names = list(dict.fromkeys(report_names))
+        stats['listed'] = len(names)
+        report_progress(stats)
+
+        for chunk in _chunks(names, settings.ARCHIVE_PROGRESS_CHUNK_SIZE):
+            results = sftp_api.move_files_from_remote(
+                remote_paths=[remote_dir + DEFAULT_PATH_SEP + name for name in chunk],
+                local_dir=local_path,
+                parallelism=settings.SFTP_TRANSFER_PARALLELISM,
+                transfer_mode=rack.report_config.transfer_mode,
+                verify_checksum=settings.SFTP_VERIFY_CHECKSUM,
+            )
+            for name in chunk:
+                if results[remote_dir + DEFAULT_PATH_SEP + name]:
+                    moved.append(name)
+                    stats['transferred'] += 1
+                    stats['bytes'] += os.path.getsize(os.path.join(local_path, name))
+            report_progress(stats)
+
+    if report_names is None:
+        # files that could not be moved stay past the watermark and are listed again by the next pull
+        moved_names = set(moved)
+        rack.report_config.advance_listing_watermark(
+            listing_watermark(list(itertools.takewhile(lambda f: f.filename in moved_names, files))))
+    forget_remote_reports(rack, moved)
+
+    for chunk in _chunks(moved, settings.INGEST_BULK_SIZE):
+        stats['rows_written'] += ingest_reports(archive, local_path, chunk)
+        report_progress(stats)
+
+    return stats
+
+
+def parse_report_created(report_name):
+    """
+    Parses the creation time from report names like '2023-01-31_12-00-00_Testresult.html'.
+    :return: Aware datetime. None, if the name does not start with a timestamp.
+    """
+    try:
+        return make_aware(datetime.strptime(report_name.split('_Testresult')[0], '%Y-%m-%d_%H-%M-%S'))
+    except ValueError:
+        return None
+
+
+def ingest_reports(archive: ReportArchive, local_path, report_names):
+    """
+    Adds the given reports from the local staging directory to the archive and their text to the search index. Reports
+    already in the archive are skipped and their staged files removed. The staged files are only moved into the report
+    storage once the reports are committed, if adding them fails they stay in the staging directory. Runs a constant
+    number of queries, independent of the number of reports, unless another ingest adds the same reports meanwhile.
+    :param archive:      Archive the reports are added to.
+    :param local_path:   Local directory the reports have been moved to.
+    :param report_names: File names of the reports.
+    :return: Number of reports added.
+    """
+    parsed = {name: parse_report_created(name) for name in report_names}
+    for name in [name for name, created in parsed.items() if created is None]:
+        logger.warning(UNPARSABLE_REPORT_NAME.format(name))
+        del parsed[name]
+
+    existing = set(Report.objects.filter(archive=archive, name__in=parsed).values_list('name', flat=True))
+
+    reports = []
+    texts = {}
+    staged = {}  # report name: (staged path, path of the file to store)
+    for name, created in parsed.items():
+        staged_path = os.path.join(local_path, name)
+        if name in existing:
+            os.remove(staged_path)
+            continue
+        summary, parser = parse_report(staged_path, name)
+        report = Report(
+            archive=archive,
+            name=name,
+            created=created,
+            verdict=summary['verdict'],
+            tests_total=summary['tests_total'],
+            tests_failed=summary['tests_failed'],
+            duration=summary['duration'],
+            dut=summary['dut'],
+            failures='\n'.join(summary['failures']) or None,
+            parser=parser,
+        )
+        staged[name] = (staged_path, prepare_report_file(report, staged_path))
+        reports.append(report)
+        texts[name] = summary['text']
+
+    try:
+        with transaction.atomic():
+            reports = insert_reports(reports)
+            ReportBlob.add_references([report.file.name for report in reports])
+            index_reports({report.pk: texts[report.name] for report in reports})
+            ReportArchive.add_to_stats(reports)
+            transaction.on_commit(lambda: invalidate_report_counts(archive.pk))
+            transaction.on_commit(lambda: place_report_files(reports, staged))
+    except Exception:
+        for staged_path, file_path in staged.values():
+            if file_path != staged_path and os.path.exists(file_path):
+                os.remove(file_path)
+        raise
+    return len(reports)
+
+
+def insert_reports(reports):
+    """
+    Inserts the reports in one query. If another ingest has inserted some of them meanwhile, they are inserted one by
+    one and those are skipped.
+    :return: The reports inserted, with their primary keys set.
+    """
+    try:
+        with transaction.atomic():
+            return Report.objects.bulk_create(reports)
+    except IntegrityError:
+        pass
+
+    inserted = []
+    for report in reports:
+        try:
+            with transaction.atomic():
+                report.save(force_insert=True)
+            inserted.append(report)
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def prepare_report_file(report: Report, staged_path):
+    """
+    Points the report at the blob of its staged file in the content addressed report storage. The file is compressed
+    with REPORT_COMPRESSION first, if set, the staged file is kept until the report is stored, see place_report_files.
+    :return: Path to the file to be moved into the report storage.
+    """
+    if settings.REPORT_COMPRESSION:
+        staged_path = compress_file(staged_path, settings.REPORT_COMPRESSION, keep_original=True)
+    report.file.name = report.file.storage.name_for(staged_path)
+    return staged_path
+
+
+def place_report_files(reports, staged):
+    """
+    Moves the files of the inserted reports into the content addressed report storage by renaming them, so their bytes
+    are never copied, and removes the staged files of all other reports. The staging directory has to be on the same
+    file system as MEDIA_ROOT.
+    :param reports: Inserted reports.
+    :param staged:  {report name: (staged path, path of the file to store)} of all reports that were to be inserted.
+    """
+    inserted = {report.name: report for report in reports}
+    for name, (staged_path, file_path) in staged.items():
+        try:
+            if name in inserted:
+                inserted[name].file.storage.adopt(file_path, name=inserted[name].file.name)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+            if file_path != staged_path and os.path.exists(staged_path):
+                os.remove(staged_path)
+        except OSError as err:
+            logger.error(PLACE_REPORT_ERROR.format(name, os.path.dirname(staged_path), err))
+
+
+def get_archive_job(rack_pk):
+    """
+    :return: Id of the latest archive job of the rack. None, if there is none.
+    """
+    return cache.get(ARCHIVE_JOB_KEY.format(rack_pk))
+
+
+def claim_archive_job(rack_pk, job_id):
+    """
+    Registers job_id as the archive job of the rack unless another archive job of the rack is still running.
+    :return: Id of the running job. None, if job_id has been registered.
+    """
+    key = ARCHIVE_JOB_KEY.format(rack_pk)
+    if not cache.add(key, job_id, timeout=settings.ARCHIVE_JOB_TIMEOUT):
+        running_job_id = cache.get(key)
+        if running_job_id is not None and running_job_id != job_id and not AsyncResult(running_job_id).ready():
+            return running_job_id
+        cache.set(key, job_id, timeout=settings.ARCHIVE_JOB_TIMEOUT)
+    return None
+
+
+def start_archive_job(rack: Rack):
+    """
+    Queues an archive job for the rack unless one is already running, in which case that job is joined.
+    :return: Tuple of the job id and whether an already running job was joined.
+    """
+    from .tasks import archive_reports_task
+
+    job_id = str(uuid.uuid4())
+    running_job_id = claim_archive_job(rack.pk, job_id)
+    if running_job_id is not None:
+        return running_job_id, True
+
+    archive_reports_task.apply_async(args=[rack.pk], task_id=job_id)
+    return job_id, False
+
+
+def get_archive_job_status(job_id):
+    """
+    :return: Dict with the state of the archive job and its progress, result or error.
+    """
+    result = AsyncResult(job_id)
+    status = {'job_id': job_id, 'state': result.state, 'progress': None, 'error': None}
+    if result.state == 'PROGRESS' or result.successful():
+        status['progress'] = result.info
+    elif result.failed():
+        status['error'] = str(result.info)
+    return status
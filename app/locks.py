@@ -0,0 +1,35 @@
+import uuid
+
+from django.core.cache import cache
+
+
+class CacheSemaphore:
+    """
+    Counting semaphore shared by all web and worker processes through the cache. Slots expire after timeout seconds, so
+    a crashed holder can not block the semaphore forever.
+    """
+
+    def __init__(self, name, limit, timeout):
+        """
+        :param name:    Name of the semaphore, used as cache key prefix.
+        :param limit:   Number of slots.
+        :param timeout: Seconds after which an unreleased slot is freed.
+        """
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+
+    def acquire(self):
+        """
+        :return: Key of the acquired slot, to be passed to release. None, if all slots are taken.
+        """
+        token = str(uuid.uuid4())
+        for i in range(self.limit):
+            slot = f'semaphore-{self.name}-{i}'
+            if cache.add(slot, token, timeout=self.timeout):
+                return slot
+        return None
+
+    @staticmethod
+    def release(slot):
+        cache.delete(slot)
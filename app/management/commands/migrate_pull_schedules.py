@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app.models import ReportConfig
+
+
+class Command(BaseCommand):
+    help = 'Moves racks still pulled by a per rack PeriodicTask over to the pull dispatcher, see ' \
+           'dispatch_due_pulls_task, and removes their CrontabSchedule and PeriodicTask.'
+
+    def handle(self, *args, **options):
+        n_migrated = ReportConfig.migrate_legacy_schedules()
+        self.stdout.write(f"Migrated {n_migrated} report configs")
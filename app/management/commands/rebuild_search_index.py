@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Report
+from app.report_parsers import extract_text
+from app.search import create_search_index, index_reports
+from app.storage import open_decompressed
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Indexes the text of all archived reports for the full-text search, e.g. reports archived before the ' \
+           'search index existed.'
+
+    def handle(self, *args, **options):
+        create_search_index()
+        n_indexed = 0
+        texts = {}
+        for report in Report.objects.exclude(file='').only('pk', 'file').iterator(chunk_size=BATCH_SIZE):
+            try:
+                with open_decompressed(report.file.storage, report.file.name) as f:
+                    texts[report.pk] = extract_text(f)
+            except OSError as err:
+                self.stderr.write(f"Skipping report {report.pk}: {err}")
+                continue
+            if len(texts) >= BATCH_SIZE:
+                index_reports(texts)
+                n_indexed += len(texts)
+                texts = {}
+        index_reports(texts)
+        n_indexed += len(texts)
+        self.stdout.write(f"Indexed {n_indexed} reports")
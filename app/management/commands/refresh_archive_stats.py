@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app.models import ReportArchive
+
+
+class Command(BaseCommand):
+    help = 'Recounts the report statistics of all archives, e.g. after reports have been changed outside the app.'
+
+    def handle(self, *args, **options):
+        for archive in ReportArchive.objects.with_report_stats():
+            archive.reports_total = archive.n_reports
+            archive.reports_passed = archive.n_passed
+            archive.reports_failed = archive.n_failed
+            archive.last_report_at = archive.latest_report_at
+            archive.save(update_fields=['reports_total', 'reports_passed', 'reports_failed', 'last_report_at'])
+            self.stdout.write(f"{archive}: {archive.reports_total} reports, {archive.reports_passed} passed, "
+                              f"{archive.reports_failed} failed")
@@ -0,0 +1,51 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from app.models import Rack
+from app.watch import watch_rack
+from dashboard_racks import settings
+
+
+class Command(BaseCommand):
+    help = 'Watches the remote report directories of the racks in watch mode and archives new reports as they arrive.'
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        watchers = {}  # {rack pk: (thread, stop event, watched configuration)}
+        try:
+            while not stop.is_set():
+                racks = {
+                    rack.pk: rack for rack in Rack.objects.select_related('ssh_config', 'report_config')
+                    .filter(report_config__watch_mode=True, ssh_config__isnull=False)
+                }
+
+                # stop watches of racks that left watch mode or whose configuration changed
+                for rack_pk, (thread, stop_rack, config) in list(watchers.items()):
+                    if rack_pk not in racks or config != self._watched_config(racks[rack_pk]):
+                        stop_rack.set()
+                    if not thread.is_alive():
+                        del watchers[rack_pk]
+
+                # (re)start watches, failed watches are retried once per WATCH_RESTART_DELAY
+                for rack_pk, rack in racks.items():
+                    if rack_pk not in watchers:
+                        stop_rack = threading.Event()
+                        thread = threading.Thread(target=watch_rack, args=(rack, stop_rack), name=f'watch-{rack.name}',
+                                                  daemon=True)
+                        thread.start()
+                        watchers[rack_pk] = (thread, stop_rack, self._watched_config(rack))
+                        self.stdout.write(f"Watching rack '{rack.name}'")
+
+                stop.wait(settings.WATCH_RESTART_DELAY)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for thread, stop_rack, _ in watchers.values():
+                stop_rack.set()
+            for thread, _, _ in watchers.values():
+                thread.join(timeout=settings.WATCH_BATCH_DELAY * 2)
+
+    @staticmethod
+    def _watched_config(rack):
+        return rack.ssh_config.get_connection_kwargs(), rack.report_config.remote_report_path
@@ -1,13 +1,24 @@
 import os
 import platform
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django_celery_beat.models import CrontabSchedule
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
 from dashboard_racks import settings
+from .storage import ContentAddressedStorage
+from .utils.paramiko_wrapper import TRANSFER_MODE_SFTP, TRANSFER_MODE_TAR
+
+report_storage = ContentAddressedStorage()
 
 
 class SshConfig(models.Model):
@@ -17,6 +28,18 @@ class SshConfig(models.Model):
     private_key = models.FileField(_('Private key'), null=True)
     port = models.BigIntegerField(_("Port"), default=21)
 
+    def get_connection_kwargs(self):
+        """
+        Keyword arguments for the connection helpers in app.utils.paramiko_wrapper.
+        """
+        return dict(
+            hostname=self.hostname,
+            username=self.username,
+            password=self.password,
+            private_key=self.private_key.path if self.private_key else '',
+            port=self.port,
+        )
+
     def __str__(self):
         return self.hostname
 
@@ -41,6 +64,175 @@ class ReportConfig(models.Model):
         related_name='report_config'
     )
 
+    next_pull_at = models.DateTimeField(
+        verbose_name='Next pull',
+        null=True,
+        db_index=True
+    )
+
+    # adaptive polling, see record_pull
+    adaptive_polling = models.BooleanField(
+        verbose_name='Adaptive polling',
+        default=False,
+        help_text='Poll busy racks more and idle racks less often instead of daily at the pull reports time.'
+    )
+
+    min_poll_interval = models.PositiveIntegerField(
+        verbose_name='Minimum poll interval [s]',
+        default=settings.ADAPTIVE_POLL_MIN_INTERVAL
+    )
+
+    max_poll_interval = models.PositiveIntegerField(
+        verbose_name='Maximum poll interval [s]',
+        default=settings.ADAPTIVE_POLL_MAX_INTERVAL
+    )
+
+    poll_interval = models.PositiveIntegerField(
+        verbose_name='Current poll interval [s]',
+        default=settings.ADAPTIVE_POLL_MIN_INTERVAL
+    )
+
+    arrival_rate = models.FloatField(
+        verbose_name='Report arrival rate [1/h]',
+        default=0
+    )
+
+    empty_poll_streak = models.PositiveIntegerField(
+        verbose_name='Empty polls in a row',
+        default=0
+    )
+
+    last_pulled_at = models.DateTimeField(
+        verbose_name='Last pull',
+        null=True
+    )
+
+    watch_mode = models.BooleanField(
+        verbose_name='Watch mode',
+        default=False,
+        help_text='Archive new reports as soon as they are written, polling is only used while the watch is down.'
+    )
+
+    transfer_mode = models.CharField(
+        verbose_name='Transfer mode',
+        max_length=8,
+        choices=[(TRANSFER_MODE_SFTP, 'SFTP, file by file'), (TRANSFER_MODE_TAR, 'tar stream, needs tar on the rack')],
+        default=TRANSFER_MODE_SFTP
+    )
+
+    # (mtime, name) of the newest report archived by listing, see advance_listing_watermark
+    listing_watermark_mtime = models.IntegerField(
+        verbose_name='Listing watermark time',
+        null=True
+    )
+
+    listing_watermark_name = models.CharField(
+        verbose_name='Listing watermark name',
+        max_length=254,
+        blank=True,
+        default=''
+    )
+
+    @property
+    def listing_watermark(self):
+        """
+        :return: Watermark (modification time, file name) past which the remote report directory is listed. None, if
+                 the directory has to be listed completely.
+        """
+        if self.listing_watermark_mtime is None:
+            return None
+        return self.listing_watermark_mtime, self.listing_watermark_name
+
+    def advance_listing_watermark(self, watermark):
+        """
+        Moves the listing watermark forward to the given one. Older watermarks are ignored.
+        """
+        if watermark is None or (self.listing_watermark is not None and tuple(watermark) <= self.listing_watermark):
+            return
+        self.listing_watermark_mtime, self.listing_watermark_name = watermark
+        self.save(update_fields=['listing_watermark_mtime', 'listing_watermark_name'])
+
+    def get_next_pull_at(self, after=None):
+        """
+        :param after: Point in time after which the next pull is due, defaults to now.
+        :return: Next occurrence of pull_reports_time (in CELERY_TIMEZONE) after the given time, or the time after the
+                 current poll interval with adaptive polling. None, if the reports are not pulled on a schedule.
+        """
+        if self.adaptive_polling:
+            return (after or timezone.now()) + timedelta(seconds=self.poll_interval)
+        if self.pull_reports_time is None:
+            return None
+        tz = ZoneInfo(settings.CELERY_TIMEZONE)
+        after = (after or timezone.now()).astimezone(tz)
+        next_pull_at = datetime.combine(after.date(), self.pull_reports_time, tzinfo=tz)
+        if next_pull_at <= after:
+            next_pull_at = datetime.combine(after.date() + timedelta(days=1), self.pull_reports_time, tzinfo=tz)
+        return next_pull_at
+
+    def record_pull(self, n_reports, succeeded=True, now=None):
+        """
+        Updates the arrival rate estimate and the poll interval after a pull and schedules the next one.
+        Empty or failed pulls double the interval, up to max_poll_interval. Pulls that found reports set it to the time
+        expected until ADAPTIVE_POLL_TARGET_BATCH new reports have arrived, at least min_poll_interval.
+        :param n_reports: Number of reports the pull archived.
+        :param succeeded: False, if the pull failed.
+        :param now:       Time of the pull, defaults to now.
+        """
+        now = now or timezone.now()
+        if succeeded:
+            elapsed = (now - self.last_pulled_at).total_seconds() if self.last_pulled_at else self.poll_interval
+            rate = n_reports / max(elapsed, 1) * 3600
+            smoothing = settings.ADAPTIVE_POLL_RATE_SMOOTHING
+            self.arrival_rate = smoothing * rate + (1 - smoothing) * self.arrival_rate
+            self.last_pulled_at = now
+
+        if not succeeded or n_reports == 0:
+            self.empty_poll_streak += 1
+            interval = self.poll_interval * settings.ADAPTIVE_POLL_BACKOFF
+        else:
+            self.empty_poll_streak = 0
+            interval = settings.ADAPTIVE_POLL_TARGET_BATCH / self.arrival_rate * 3600
+        self.poll_interval = int(min(max(interval, self.min_poll_interval), self.max_poll_interval))
+
+        fields = ['arrival_rate', 'empty_poll_streak', 'poll_interval', 'last_pulled_at']
+        if self.adaptive_polling:
+            self.next_pull_at = now + timedelta(seconds=self.poll_interval)
+            fields.append('next_pull_at')
+        self.save(update_fields=fields)
+
+    def drop_legacy_schedule(self):
+        """
+        Removes the per rack CrontabSchedule and PeriodicTask, pulls are dispatched by dispatch_due_pulls_task.
+        """
+        crontab = self.contrab_schedule
+        if crontab is None:
+            return
+        self.contrab_schedule = None
+        self.save(update_fields=['contrab_schedule'])
+        crontab.delete()
+        self.PeriodicTasks.update_changed()
+
+    @classmethod
+    def migrate_legacy_schedules(cls, after=None):
+        """
+        Moves report configs still scheduled by a per rack PeriodicTask over to next_pull_at. Report configs without
+        next_pull_at get the next occurrence of their pull time after the given time and all legacy schedules are
+        removed.
+        :param after: Point in time after which the next pull is due, defaults to now.
+        :return: Number of report configs migrated.
+        """
+        legacy = list(cls.objects.filter(Q(contrab_schedule__isnull=False) |
+                                         Q(next_pull_at__isnull=True, pull_reports_time__isnull=False)))
+        for report_config in legacy:
+            if report_config.next_pull_at is None:
+                report_config.next_pull_at = report_config.get_next_pull_at(after)
+                report_config.save(update_fields=['next_pull_at'])
+            report_config.drop_legacy_schedule()
+        # tasks whose crontab has been detached from its report config by hand
+        if PeriodicTask.objects.filter(task='pull_reports_task', name__startswith='periodict_task_').delete()[0]:
+            cls.PeriodicTasks.update_changed()
+        return len(legacy)
+
     def __str__(self):
         return 'Report Config'
 
@@ -74,16 +266,98 @@ class Rack(models.Model):
         return self.name
 
 
+class ReportArchiveQuerySet(models.QuerySet):
+    def with_report_stats(self):
+        """
+        Annotates the archives with n_reports, n_passed, n_failed and latest_report_at, counted by the database.
+        """
+        return self.annotate(
+            n_reports=Count('reports'),
+            n_passed=Count('reports', filter=Q(reports__verdict__iexact='passed')),
+            n_failed=Count('reports', filter=Q(reports__verdict__iexact='failed')),
+            latest_report_at=Max('reports__created'),
+        )
+
+
 class ReportArchive(models.Model):
     name = models.CharField(max_length=254, verbose_name=_('Name of rack'))
 
+    # report statistics, kept up to date by add_to_stats and remove_from_stats
+    reports_total = models.IntegerField(verbose_name='Reports', default=0)
+    reports_passed = models.IntegerField(verbose_name='Passed reports', default=0)
+    reports_failed = models.IntegerField(verbose_name='Failed reports', default=0)
+    last_report_at = models.DateTimeField(verbose_name='Latest report', null=True)
+
+    objects = ReportArchiveQuerySet.as_manager()
+
     def get_number_of_passed(self):
-        n = len([r for r in self.reports.all() if r.verdict.lower() == 'passed'])
-        return n
+        return self.reports_passed
 
     def get_number_of_failed(self):
-        n = len([r for r in self.reports.all() if r.verdict.lower() == 'failed'])
-        return n
+        return self.reports_failed
+
+    @staticmethod
+    def _group_stats(reports):
+        """
+        :return: {archive pk: (number of reports, passed, failed, latest creation time)}
+        """
+        groups = {}
+        for report in reports:
+            groups.setdefault(report.archive_id, []).append(report)
+        stats = {}
+        for archive_id, group in groups.items():
+            verdicts = Counter((report.verdict or '').lower() for report in group)
+            created = [report.created for report in group if report.created is not None]
+            stats[archive_id] = (len(group), verdicts['passed'], verdicts['failed'], max(created, default=None))
+        return stats
+
+    @classmethod
+    def add_to_stats(cls, reports):
+        """
+        Counts newly added reports in the statistics of their archives, one atomic update per archive.
+        """
+        for archive_id, (total, passed, failed, latest) in cls._group_stats(reports).items():
+            updates = {
+                'reports_total': F('reports_total') + total,
+                'reports_passed': F('reports_passed') + passed,
+                'reports_failed': F('reports_failed') + failed,
+            }
+            if latest is not None:
+                updates['last_report_at'] = Greatest(Coalesce('last_report_at', Value(latest)), Value(latest))
+            cls.objects.filter(pk=archive_id).update(**updates)
+
+    @classmethod
+    def remove_from_stats(cls, reports):
+        """
+        Removes deleted reports from the statistics of their archives, one atomic update per archive. Has to be called
+        after the reports have been deleted.
+        """
+        for archive_id, (total, passed, failed, latest) in cls._group_stats(reports).items():
+            cls.objects.filter(pk=archive_id).update(
+                reports_total=F('reports_total') - total,
+                reports_passed=F('reports_passed') - passed,
+                reports_failed=F('reports_failed') - failed,
+                last_report_at=Subquery(Report.objects.filter(archive=OuterRef('pk'), created__isnull=False)
+                                        .order_by(F('created').desc()).values('created')[:1]),
+            )
+
+    def remove_report_references(self):
+        """
+        Removes the blob references of all reports of the archive, e.g. before the reports are cascade deleted with it.
+        """
+        ReportBlob.remove_references(self.reports.exclude(file='').values_list('file', flat=True))
+
+    def refresh_stats(self):
+        """
+        Recounts the report statistics of the archive from its reports.
+        """
+        stats = ReportArchive.objects.with_report_stats().filter(pk=self.pk) \
+            .values('n_reports', 'n_passed', 'n_failed', 'latest_report_at').get()
+        self.reports_total = stats['n_reports']
+        self.reports_passed = stats['n_passed']
+        self.reports_failed = stats['n_failed']
+        self.last_report_at = stats['latest_report_at']
+        self.save(update_fields=['reports_total', 'reports_passed', 'reports_failed', 'last_report_at'])
 
     def __str__(self):
         return self.name
@@ -114,13 +388,15 @@ class Report(models.Model):
 
     file = models.FileField(
         upload_to=rack_archive_report_upload_path,
+        storage=report_storage,
         null=True
     )
 
     verdict = models.CharField(
         max_length=10,
         choices=VERDICT_CHOICES,
-        null=True
+        null=True,
+        db_index=True
     )
 
     created = models.DateTimeField(
@@ -129,8 +405,51 @@ class Report(models.Model):
 
     )
 
+    # summary parsed from the report content at ingest, see app.report_parsers
+    tests_total = models.PositiveIntegerField(
+        verbose_name='Tests',
+        null=True,
+        db_index=True
+    )
+
+    tests_failed = models.PositiveIntegerField(
+        verbose_name='Failed tests',
+        null=True,
+        db_index=True
+    )
+
+    duration = models.DurationField(
+        verbose_name='Duration',
+        null=True
+    )
+
+    dut = models.CharField(
+        max_length=254,
+        verbose_name='DUT',
+        null=True,
+        db_index=True
+    )
+
+    failures = models.TextField(
+        verbose_name='Failed tests',
+        null=True
+    )
+
+    parser = models.CharField(
+        max_length=64,
+        verbose_name='Parser',
+        null=True
+    )
+
     class Meta:
         ordering = ['created']
+        constraints = [
+            models.UniqueConstraint(fields=['archive', 'name'], name='unique_report_name_per_archive'),
+        ]
+        indexes = [
+            models.Index(fields=['archive', 'created'], name='report_archive_created_idx'),
+            models.Index(fields=['archive', 'verdict', 'created'], name='report_archive_verdict_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -139,6 +458,69 @@ class Report(models.Model):
         return reverse_lazy('rack-detail', kwargs={'pk': self.pk, 'rack_pk': self.archive.rack.pk})
 
 
+class ReportBlob(models.Model):
+    """
+    Reference count of a report file in the content addressed report storage.
+    """
+    name = models.CharField(max_length=254, unique=True)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def add_references(cls, names):
+        """
+        Adds one reference per occurrence of a blob name.
+        """
+        counts = Counter(names)
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(name=name) for name in counts], ignore_conflicts=True)
+            for increment, group in _group_by_count(counts).items():
+                cls.objects.filter(name__in=group).update(refcount=F('refcount') + increment)
+
+    @classmethod
+    def remove_references(cls, names):
+        """
+        Removes one reference per occurrence of a blob name and deletes the blobs whose last reference is gone, see
+        delete_orphan. Files that are not tracked as blobs are deleted right away.
+        """
+        counts = Counter(name for name in names if name)
+        with transaction.atomic():
+            tracked = set(cls.objects.select_for_update().filter(name__in=counts).values_list('name', flat=True))
+            for decrement, group in _group_by_count({n: c for n, c in counts.items() if n in tracked}).items():
+                cls.objects.filter(name__in=group).update(refcount=F('refcount') - decrement)
+            orphans = list(cls.objects.filter(name__in=tracked, refcount__lte=0).values_list('name', flat=True))
+            untracked = [n for n in counts if n not in tracked]
+            transaction.on_commit(lambda: [report_storage.delete(name) for name in untracked] +
+                                          [cls.delete_orphan(name) for name in orphans])
+
+    @classmethod
+    def delete_orphan(cls, name):
+        """
+        Deletes a blob and its row if it is still unreferenced. The row is deleted first and the file while its lock is
+        held, so an ingest referencing the same content meanwhile either keeps the row alive or re-creates it after the
+        file is gone and stores its own copy.
+        """
+        with transaction.atomic():
+            if cls.objects.filter(name=name, refcount__lte=0).delete()[0]:
+                report_storage.delete(name)
+
+
+def remove_archive_references(sender, instance: ReportArchive, **kwargs):
+    """
+    pre_delete handler of ReportArchive, the reports deleted with an archive release their blobs.
+    """
+    instance.remove_report_references()
+
+
+def _group_by_count(counts):
+    groups = {}
+    for name, count in counts.items():
+        groups.setdefault(count, []).append(name)
+    return groups
+
+
 class Watchtdog(models.Model):
     name = models.CharField(
         max_length=254,
@@ -0,0 +1,77 @@
+import base64
+from collections import namedtuple
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_token', 'prev_token'])
+
+
+def encode_token(report):
+    """
+    :return: Opaque token of the (created, pk) position of the report.
+    """
+    created = report.created.isoformat() if report.created is not None else ''
+    return base64.urlsafe_b64encode(f'{created}|{report.pk}'.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """
+    :return: Tuple of the creation time (None for reports without one) and the pk. None, if the token is invalid.
+    """
+    try:
+        created, _, pk = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode().partition('|')
+        return (parse_datetime(created) if created else None), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _after(position):
+    created, pk = position
+    if created is None:
+        return Q(created__isnull=True, pk__gt=pk) | Q(created__isnull=False)
+    return Q(created__gt=created) | Q(created=created, pk__gt=pk)
+
+
+def _before(position):
+    created, pk = position
+    if created is None:
+        return Q(created__isnull=True, pk__lt=pk)
+    return Q(created__lt=created) | Q(created=created, pk__lt=pk) | Q(created__isnull=True)
+
+
+def keyset_paginate(queryset, page_size, after=None, before=None):
+    """
+    Pages through a report queryset ordered by (created, pk), reports without creation time first. Only the rows of
+    the requested page are fetched, whatever the size of the queryset, and tokens stay valid while reports are added
+    or deleted.
+    :param queryset:  Reports to page through.
+    :param page_size: Number of reports per page.
+    :param after:     Token of the last report of the previous page.
+    :param before:    Token of the first report of the next page, used to go back.
+    :return: KeysetPage with the reports of the page and the tokens of the next and previous page, None if there is none.
+    """
+    ascending = [F('created').asc(nulls_first=True), 'pk']
+    descending = [F('created').desc(nulls_last=True), '-pk']
+
+    before = decode_token(before) if before else None
+    after = decode_token(after) if after else None
+
+    if before is not None:
+        items = list(queryset.filter(_before(before)).order_by(*descending)[:page_size + 1])
+        has_prev = len(items) > page_size
+        items = items[:page_size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            queryset = queryset.filter(_after(after))
+        items = list(queryset.order_by(*ascending)[:page_size + 1])
+        has_next = len(items) > page_size
+        items = items[:page_size]
+        has_prev = after is not None
+
+    return KeysetPage(
+        items=items,
+        next_token=encode_token(items[-1]) if items and has_next else None,
+        prev_token=encode_token(items[0]) if items and has_prev else None,
+    )
@@ -0,0 +1,251 @@
+import codecs
+import logging
+import re
+from datetime import timedelta
+from html.parser import HTMLParser
+
+from django.utils.module_loading import import_string
+
+from dashboard_racks import settings
+
+logger = logging.getLogger('report_parsers')
+
+PARSER_ERROR = "Could not parse report '{0}' with {1}: {2}"
+
+CHUNK_SIZE = 64 * 1024
+MAX_FAILURES = 50  # failed test names kept per report
+MAX_TEXT_LENGTH = 1024  # longest text fragment looked at, longer fragments are cut
+SKIPPED_TEXT_TAGS = ('script', 'style')  # text of these tags is not kept for the search index
+
+
+def guess_verdict(report_name):
+    """
+    Guesses the verdict of a report from its file name.
+    """
+    return 'FAILED' if 'error' in report_name.lower() else 'PASSED'
+
+
+def new_summary():
+    return {
+        'verdict': None,
+        'tests_total': None,
+        'tests_failed': None,
+        'duration': None,
+        'dut': None,
+        'failures': [],
+        'text': '',
+    }
+
+
+class ReportParser(HTMLParser):
+    """
+    Base class of the report parsers. Parsers are fed the report in chunks, so memory use does not depend on the report
+    size. Subclasses fill self.summary from the text fragments passed to handle_text. The visible text of the report is
+    kept in summary['text'] for the search index, up to REPORT_SEARCH_MAX_TEXT characters.
+    """
+    name = 'base'
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.summary = new_summary()
+        self.tags = []
+        self.text = []
+        self.text_length = 0
+
+    @classmethod
+    def accepts(cls, report_name, head):
+        """
+        :param report_name: File name of the report.
+        :param head:        First chunk of the report.
+        :return: True, if the parser understands the report format. False, otherwise.
+        """
+        return True
+
+    def handle_starttag(self, tag, attrs):
+        self.tags.append((tag, dict(attrs).get('class', '')))
+        del self.tags[:-32]
+
+    def handle_endtag(self, tag):
+        while self.tags:
+            if self.tags.pop()[0] == tag:
+                break
+
+    def handle_data(self, data):
+        text = ' '.join(data.split())[:MAX_TEXT_LENGTH]
+        if text:
+            self.keep_text(text)
+            self.handle_text(text)
+
+    def keep_text(self, text):
+        if self.text_length >= settings.REPORT_SEARCH_MAX_TEXT or (self.tags and self.tags[-1][0] in SKIPPED_TEXT_TAGS):
+            return
+        self.text.append(text)
+        self.text_length += len(text) + 1
+
+    def handle_text(self, text):
+        """
+        Called with every text fragment of the report, whitespace normalized. Does nothing, the base parser only keeps
+        the text.
+        """
+
+    def close(self):
+        super().close()
+        self.summary['text'] = ' '.join(self.text)[:settings.REPORT_SEARCH_MAX_TEXT]
+
+    def add_failure(self, test_name):
+        if len(self.summary['failures']) < MAX_FAILURES:
+            self.summary['failures'].append(test_name)
+
+
+class PytestHtmlParser(ReportParser):
+    """
+    Parses reports of the pytest-html plugin.
+    """
+    name = 'pytest-html'
+
+    TESTS_RAN = re.compile(r'(\d+) tests? (?:ran|took) .*?([\d.]+) (?:seconds|s)\b')
+    COUNT = re.compile(r'^(\d+) (passed|failed|errors?|skipped|xfailed|xpassed)')
+    DUT_KEYS = ('dut', 'device', 'serial')
+
+    def __init__(self):
+        super().__init__()
+        self.counts = {}
+        self.environment_key = None
+        self.result = None
+
+    @classmethod
+    def accepts(cls, report_name, head):
+        return b'pytest-html' in head or b'results-table' in head
+
+    def handle_text(self, text):
+        tag, css_class = self.tags[-1] if self.tags else ('', '')
+
+        match = self.TESTS_RAN.search(text)
+        if match:
+            self.summary['tests_total'] = int(match.group(1))
+            self.summary['duration'] = timedelta(seconds=float(match.group(2)))
+            return
+
+        match = self.COUNT.match(text)
+        if match and tag == 'span':
+            self.counts[match.group(2).rstrip('s')] = int(match.group(1))
+            return
+
+        if 'col-result' in css_class:
+            self.result = text.lower()
+        elif 'col-name' in css_class or 'col-testId' in css_class:
+            if self.result in ('failed', 'error'):
+                self.add_failure(text)
+            self.result = None
+        elif tag == 'td' and self.environment_key is None and text.lower() in self.DUT_KEYS:
+            self.environment_key = text
+        elif tag == 'td' and self.environment_key is not None:
+            self.summary['dut'] = self.summary['dut'] or text
+            self.environment_key = None
+
+    def close(self):
+        super().close()
+        failed = self.counts.get('failed', 0) + self.counts.get('error', 0)
+        if self.counts:
+            self.summary['tests_failed'] = failed
+            if self.summary['tests_total'] is None:
+                self.summary['tests_total'] = sum(self.counts.values())
+            self.summary['verdict'] = 'FAILED' if failed else 'PASSED'
+
+
+class GenericHtmlParser(ReportParser):
+    """
+    Fallback parser looking for common phrases like '12 passed', '1 failed', 'Duration: 3.5 s' or 'DUT: ABC123' in the
+    report text.
+    """
+    name = 'generic'
+
+    PASSED = re.compile(r'\b(\d+)\s+(?:tests?\s+)?passed', re.IGNORECASE)
+    FAILED = re.compile(r'\b(\d+)\s+(?:tests?\s+)?(?:failed|errors?)', re.IGNORECASE)
+    TOTAL = re.compile(r'\b(\d+)\s+tests?\b', re.IGNORECASE)
+    DURATION = re.compile(r'duration\s*:?\s*([\d.]+)\s*(ms|s|sec|seconds|min|minutes)?', re.IGNORECASE)
+    DUT = re.compile(r'\b(?:dut|serial(?:\s+number)?)\s*[:=]\s*(\S+)', re.IGNORECASE)
+    VERDICT = re.compile(r'\b(?:verdict|result)\s*:?\s*(passed|failed|pass|fail)\b', re.IGNORECASE)
+    DURATION_UNITS = {'ms': 0.001, 'min': 60, 'minutes': 60}
+
+    def __init__(self):
+        super().__init__()
+        self.passed = None
+
+    def handle_text(self, text):
+        summary = self.summary
+        if summary['verdict'] is None and (match := self.VERDICT.search(text)):
+            summary['verdict'] = 'FAILED' if match.group(1).lower().startswith('fail') else 'PASSED'
+        if self.passed is None and (match := self.PASSED.search(text)):
+            self.passed = int(match.group(1))
+        if summary['tests_failed'] is None and (match := self.FAILED.search(text)):
+            summary['tests_failed'] = int(match.group(1))
+        if summary['tests_total'] is None and (match := self.TOTAL.search(text)):
+            summary['tests_total'] = int(match.group(1))
+        if summary['duration'] is None and (match := self.DURATION.search(text)):
+            factor = self.DURATION_UNITS.get((match.group(2) or 's').lower(), 1)
+            summary['duration'] = timedelta(seconds=float(match.group(1)) * factor)
+        if summary['dut'] is None and (match := self.DUT.search(text)):
+            summary['dut'] = match.group(1)
+
+    def close(self):
+        super().close()
+        summary = self.summary
+        if summary['tests_total'] is None and self.passed is not None:
+            summary['tests_total'] = self.passed + (summary['tests_failed'] or 0)
+        if summary['tests_failed'] is not None and summary['tests_total'] is not None \
+                and summary['tests_failed'] > summary['tests_total']:
+            # inconsistent counts are misparsed phrases, the verdict falls back to the guess from the report name
+            summary['tests_failed'] = summary['tests_total'] = None
+        if summary['verdict'] is None and summary['tests_failed'] is not None:
+            summary['verdict'] = 'FAILED' if summary['tests_failed'] else 'PASSED'
+
+
+def get_parser_classes():
+    return [import_string(path) for path in settings.REPORT_PARSERS]
+
+
+def parse_report(path, report_name):
+    """
+    Parses a local report file with the first parser in REPORT_PARSERS that accepts it. The file is read in chunks.
+    Fields the parser could not determine stay None, the verdict falls back to the guess from the file name.
+    :param path:        Path to the local report file.
+    :param report_name: File name of the report.
+    :return: Tuple of the summary dict and the name of the parser used.
+    """
+    parser = None
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(CHUNK_SIZE)
+            parser_class = next((c for c in get_parser_classes() if c.accepts(report_name, head)), None)
+            if parser_class is not None:
+                parser = parser_class()
+                _feed(parser, f, head)
+    except (OSError, ValueError) as err:
+        logger.warning(PARSER_ERROR.format(report_name, parser.name if parser else None, err))
+        parser = None
+
+    summary = parser.summary if parser is not None else new_summary()
+    summary['verdict'] = summary['verdict'] or guess_verdict(report_name)
+    return summary, parser.name if parser is not None else None
+
+
+def extract_text(f):
+    """
+    Extracts the visible text of a report, e.g. to index reports archived before they were parsed at ingest.
+    :param f: Report file opened in binary mode.
+    :return: The text, cut after REPORT_SEARCH_MAX_TEXT characters.
+    """
+    parser = ReportParser()
+    _feed(parser, f, f.read(CHUNK_SIZE))
+    return parser.summary['text']
+
+
+def _feed(parser, f, head):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    chunk = head
+    while chunk:
+        parser.feed(decoder.decode(chunk))
+        chunk = f.read(CHUNK_SIZE)
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
@@ -0,0 +1,137 @@
+import logging
+
+from django.db import connections, DEFAULT_DB_ALIAS, OperationalError, ProgrammingError
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Report
+
+logger = logging.getLogger('search')
+
+SEARCH_TABLE = 'app_report_search'
+SEARCH_INDEX_ERROR = "Could not create the report search index: {0}"
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'  # replaced by <mark> tags once the snippet is escaped
+SNIPPET_WORDS = 16
+
+# SQLite: FTS5 table keyed by the report id, cleaned up by a trigger when reports are deleted
+SQLITE_SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(body, tokenize='unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON {{report_table}} BEGIN "
+    f"DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; END",
+]
+# PostgreSQL: tsvector column with a GIN index, rows are deleted with their report
+POSTGRESQL_SCHEMA = [
+    f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+    f"report_id bigint PRIMARY KEY REFERENCES {{report_table}} (id) ON DELETE CASCADE, "
+    f"body text NOT NULL, "
+    f"document tsvector GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED)",
+    f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)",
+]
+
+
+def is_search_supported(connection):
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate handler creating the search index table of the reports, see SQLITE_SCHEMA and POSTGRESQL_SCHEMA.
+    """
+    connection = connections[using]
+    if not is_search_supported(connection):
+        return
+    schema = SQLITE_SCHEMA if connection.vendor == 'sqlite' else POSTGRESQL_SCHEMA
+    try:
+        with connection.cursor() as cursor:
+            for statement in schema:
+                cursor.execute(statement.format(report_table=Report._meta.db_table))
+    except (OperationalError, ProgrammingError) as err:
+        logger.warning(SEARCH_INDEX_ERROR.format(err))
+
+
+def index_reports(texts, using=DEFAULT_DB_ALIAS):
+    """
+    Adds reports to the search index, replacing their previous text.
+    :param texts: {report id: text of the report}
+    """
+    connection = connections[using]
+    if not texts or not is_search_supported(connection):
+        return
+    if connection.vendor == 'sqlite':
+        sql = f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, body) VALUES (%s, %s)"
+    else:
+        sql = (f"INSERT INTO {SEARCH_TABLE} (report_id, body) VALUES (%s, %s) "
+               f"ON CONFLICT (report_id) DO UPDATE SET body = EXCLUDED.body")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, list(texts.items()))
+
+
+def _fts5_query(query):
+    # every word is quoted, so input like 'ABC-123' or 'error:' is matched as words instead of FTS5 syntax
+    return ' '.join('"{0}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+def matching_ids(query, using=DEFAULT_DB_ALIAS):
+    """
+    :return: RawSQL selecting the ids of the reports whose text contains all words of the query.
+    """
+    if connections[using].vendor == 'sqlite':
+        return RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [_fts5_query(query)])
+    return RawSQL(f"SELECT report_id FROM {SEARCH_TABLE} WHERE document @@ plainto_tsquery('simple', %s)", [query])
+
+
+def filter_reports(queryset, query):
+    """
+    :return: The reports of the queryset whose text contains all words of the query. On databases without full-text
+             search the report names are searched instead.
+    """
+    if not is_search_supported(connections[queryset.db]):
+        return queryset.filter(name__icontains=query)
+    return queryset.filter(pk__in=matching_ids(query, queryset.db))
+
+
+def search_reports(queryset, query, limit):
+    """
+    Ranks the reports of the queryset matching the query by relevance.
+    :param queryset: Reports to search, e.g. a filtered report list.
+    :param query:    Words the reports have to contain.
+    :param limit:    Number of reports returned.
+    :return: List of the best matching reports, each with a search_snippet of its text around the matches.
+    """
+    connection = connections[queryset.db]
+    if not is_search_supported(connection):
+        return list(filter_reports(queryset, query).order_by('-created', '-pk')[:limit])
+
+    ids_sql, ids_params = queryset.order_by().values('pk').query.sql_with_params()
+    if connection.vendor == 'sqlite':
+        # +rowid keeps SQLite from handing the id list to FTS5, which would evaluate the match once per id
+        sql = (f"SELECT rowid, snippet({SEARCH_TABLE}, 0, %s, %s, '…', {SNIPPET_WORDS}) FROM {SEARCH_TABLE} "
+               f"WHERE {SEARCH_TABLE} MATCH %s AND +rowid IN ({ids_sql}) ORDER BY rank LIMIT %s")
+        params = [SNIPPET_START, SNIPPET_END, _fts5_query(query), *ids_params, limit]
+    else:
+        sql = (f"SELECT report_id, ts_headline('simple', body, q, %s) FROM ("
+               f"SELECT report_id, body, q FROM {SEARCH_TABLE}, plainto_tsquery('simple', %s) q "
+               f"WHERE document @@ q AND report_id IN ({ids_sql}) ORDER BY ts_rank(document, q) DESC LIMIT %s) hits")
+        options = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords={SNIPPET_WORDS}, MinWords=5'
+        params = [options, query, *ids_params, limit]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        hits = cursor.fetchall()
+
+    reports = queryset.model.objects.using(queryset.db).in_bulk([report_id for report_id, _ in hits])
+    results = []
+    for report_id, snippet in hits:
+        if report_id in reports:
+            report = reports[report_id]
+            report.search_snippet = format_snippet(snippet)
+            results.append(report)
+    return results
+
+
+def format_snippet(snippet):
+    """
+    :return: The escaped snippet with its matches wrapped in <mark> tags.
+    """
+    return mark_safe(escape(snippet or '').replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
@@ -0,0 +1,108 @@
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from dashboard_racks import settings
+from .models import Rack
+from .report_parsers import guess_verdict
+from .utils.paramiko_wrapper import sftp_instance, listing_watermark
+
+REMOTE_LISTING_KEY = 'remote-listing-{0}'
+REMOTE_LISTING_REFRESH_KEY = 'remote-listing-refresh-{0}'
+REMOTE_LISTING_FULL_KEY = 'remote-listing-full-{0}'
+REMOTE_REPORT_PATTERN = r'.*\.html$'
+
+RemoteReport = namedtuple('report', ['name', 'tag'])
+
+
+def fetch_remote_listing(rack: Rack, previous=None):
+    """
+    Lists the remote report directory of the rack. If a previous snapshot is given, only the reports past its
+    watermark are listed and added to it, except once every REMOTE_LISTING_FULL_INTERVAL seconds.
+    :return: Snapshot dict with the report names, the number of passed and failed reports, the listing watermark and
+             the fetch timestamp.
+    """
+    full_listing = cache.add(REMOTE_LISTING_FULL_KEY.format(rack.pk), True,
+                             timeout=settings.REMOTE_LISTING_FULL_INTERVAL)
+    incremental = not full_listing and previous is not None and previous.get('watermark') is not None
+
+    with sftp_instance(**rack.ssh_config.get_connection_kwargs()) as sftp_api:
+        files = sftp_api.list_pattern_on_remote(rack.report_config.remote_report_path, REMOTE_REPORT_PATTERN,
+                                                since=previous['watermark'] if incremental else None)
+
+    reports = list(previous['reports']) if incremental else []
+    known = set(reports)
+    reports += [f.filename for f in files if f.filename not in known]
+    snapshot = _count_verdicts({'reports': reports, 'fetched_at': timezone.now(), 'error': None})
+    snapshot['watermark'] = listing_watermark(files) or (previous['watermark'] if incremental else None)
+    return snapshot
+
+
+def _count_verdicts(snapshot):
+    n_failed = sum(guess_verdict(r) == 'FAILED' for r in snapshot['reports'])
+    snapshot['passed'] = len(snapshot['reports']) - n_failed
+    snapshot['failed'] = n_failed
+    return snapshot
+
+
+def get_remote_listing(rack: Rack):
+    """
+    :return: The cached remote listing snapshot of the rack. None, if the rack has not been listed yet.
+    """
+    return cache.get(REMOTE_LISTING_KEY.format(rack.pk))
+
+
+def refresh_remote_listing(rack: Rack):
+    """
+    Fetches the remote listing of the rack and caches it. If the rack can not be listed, the previous snapshot is kept
+    and only the error is recorded.
+    :return: The new snapshot.
+    """
+    try:
+        snapshot = fetch_remote_listing(rack, get_remote_listing(rack))
+    except Exception as ex:
+        snapshot = get_remote_listing(rack) or {'reports': [], 'passed': 0, 'failed': 0, 'fetched_at': None}
+        snapshot['error'] = str(ex)
+
+    cache.set(REMOTE_LISTING_KEY.format(rack.pk), snapshot, timeout=None)
+    cache.delete(REMOTE_LISTING_REFRESH_KEY.format(rack.pk))
+    return snapshot
+
+
+def forget_remote_reports(rack: Rack, report_names):
+    """
+    Removes reports that have been moved off the rack from its remote listing snapshot.
+    """
+    snapshot = get_remote_listing(rack)
+    if snapshot is None or not report_names:
+        return
+    report_names = set(report_names)
+    snapshot['reports'] = [r for r in snapshot['reports'] if r not in report_names]
+    cache.set(REMOTE_LISTING_KEY.format(rack.pk), _count_verdicts(snapshot), timeout=None)
+
+
+def is_stale(snapshot):
+    """
+    :return: True, if the snapshot is missing or older than REMOTE_LISTING_MAX_AGE seconds. False, otherwise.
+    """
+    if snapshot is None or snapshot['fetched_at'] is None:
+        return True
+    return timezone.now() - snapshot['fetched_at'] > timedelta(seconds=settings.REMOTE_LISTING_MAX_AGE)
+
+
+def request_refresh(rack: Rack):
+    """
+    Queues a background refresh of the remote listing unless one is already queued for the rack.
+    :return: True, if a refresh is pending. False, if it could not be queued.
+    """
+    from .tasks import refresh_remote_listing_task
+
+    if cache.add(REMOTE_LISTING_REFRESH_KEY.format(rack.pk), True, timeout=settings.REMOTE_LISTING_MAX_AGE):
+        try:
+            refresh_remote_listing_task.delay(rack.pk)
+        except Exception:
+            cache.delete(REMOTE_LISTING_REFRESH_KEY.format(rack.pk))
+            return False
+    return True
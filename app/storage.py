@@ -1,6 +1,16 @@
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
+import gzip
+import hashlib
 import os
+import shutil
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
 
 
 class OverwriteStorage(FileSystemStorage):
@@ -26,4 +36,115 @@ class OverwriteStorage(FileSystemStorage):
         # If the filename already exists, remove it as if it was a true file system
         if self.exists(name):
             os.remove(os.path.join(settings.MEDIA_ROOT, name))
-        return name
\ No newline at end of file
+        return name
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files by the SHA-256 of their content in a sharded tree 'blobs/ab/cd/<digest><extension>', so files with the
+    same content share one blob. Reference counting of the blobs is up to the caller, see app.models.ReportBlob.
+    Names outside the blob tree (e.g. files stored before this storage was introduced) keep working.
+    """
+    blob_dir = 'blobs'
+    chunk_size = 64 * 1024
+
+    def blob_name(self, digest, extension=''):
+        return '/'.join([self.blob_dir, digest[:2], digest[2:4], digest + extension])
+
+    @classmethod
+    def digest_file(cls, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def name_for(self, path, extension=None):
+        """
+        :param path:      Path to a local file.
+        :param extension: Extension of the blob name, defaults to the extension of the file including a compression
+                          extension, e.g. '.html.gz'.
+        :return: Name of the blob the file is stored as.
+        """
+        if extension is None:
+            root, extension = os.path.splitext(path)
+            if content_encoding(path):
+                extension = os.path.splitext(root)[1] + extension
+        return self.blob_name(self.digest_file(path), extension)
+
+    def adopt(self, path, extension=None, name=None):
+        """
+        Moves a local file into the blob tree by renaming it. If a blob with the same content already exists, the file
+        is removed instead. The file has to be on the same file system as the storage location.
+        :param path:      Path to the local file.
+        :param extension: Extension of the blob name, see name_for.
+        :param name:      Blob name from name_for, if already known.
+        :return: Name of the blob.
+        """
+        name = name or self.name_for(path, extension)
+        if self.exists(name):
+            os.remove(path)
+        else:
+            blob_path = self.path(name)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(path, blob_path)
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks(self.chunk_size):
+            digest.update(chunk)
+        blob_name = self.blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+        if self.exists(blob_name):
+            return blob_name
+        content.seek(0)
+        return super()._save(blob_name, content)
+
+    def get_available_name(self, name, max_length=None):
+        # blob names are derived from the content, an existing blob already holds the same bytes
+        return name
+
+
+def compress_file(path, codec='gzip', keep_original=False):
+    """
+    Compresses a local file with gzip or, if the zstandard package is installed, zstd. The compressed file replaces the
+    original. Compression is deterministic, so files with the same content still share one blob.
+    :param path:          Path to the local file.
+    :param codec:         'gzip' or 'zstd'.
+    :param keep_original: True, to keep the original file next to the compressed one.
+    :return: Path to the compressed file.
+    """
+    if codec == 'zstd' and zstandard is None:
+        codec = 'gzip'
+    compressed_path = path + COMPRESSION_EXTENSIONS[codec]
+    with open(path, 'rb') as src, open(compressed_path, 'wb') as dst:
+        if codec == 'zstd':
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+        else:
+            with gzip.GzipFile(filename='', mode='wb', fileobj=dst, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, ContentAddressedStorage.chunk_size)
+    if not keep_original:
+        os.remove(path)
+    return compressed_path
+
+
+def content_encoding(name):
+    """
+    :return: HTTP content coding of a stored file, 'gzip' or 'zstd'. None, if the file is not compressed.
+    """
+    for codec, extension in COMPRESSION_EXTENSIONS.items():
+        if name.endswith(extension):
+            return codec
+    return None
+
+
+def open_decompressed(storage, name):
+    """
+    Opens a stored file for reading its decompressed content.
+    """
+    f = storage.open(name, 'rb')
+    encoding = content_encoding(name)
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+    return f
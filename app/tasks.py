@@ -1,7 +1,17 @@
-from celery import shared_task
-from datetime import datetime
+from celery import shared_task, chord
+from datetime import datetime, timedelta
 
-from app.models import Watchtdog
+from django.core.cache import cache
+from django.utils import timezone
+
+from app.models import Watchtdog, Rack, ReportConfig
+from app.ingest import archive_reports, claim_archive_job, new_progress
+from app.locks import CacheSemaphore
+from app.snapshots import refresh_remote_listing
+from app.watch import get_watched_racks
+from dashboard_racks import settings
+
+LAST_PULL_RUN_KEY = 'pull-run-last'
 
 
 @shared_task()
@@ -23,48 +33,149 @@ def print_message(message, *args, **kwargs):
     return x
 
 
+@shared_task(name='refresh_remote_listing_task')
+def refresh_remote_listing_task(rack_pk):
+    rack = Rack.objects.select_related('ssh_config', 'report_config').filter(pk=rack_pk).first()
+    if rack is None or rack.ssh_config is None or rack.report_config is None:
+        return None
+    snapshot = refresh_remote_listing(rack)
+    return snapshot['error'] or len(snapshot['reports'])
+
+
+@shared_task(name='refresh_remote_listings_task')
+def refresh_remote_listings():
+    rack_pks = list(Rack.objects.filter(ssh_config__isnull=False, report_config__isnull=False)
+                    .values_list('pk', flat=True))
+    for rack_pk in rack_pks:
+        refresh_remote_listing_task.delay(rack_pk)
+    return len(rack_pks)
+
+
+@shared_task(bind=True, name='archive_reports_task')
+def archive_reports_task(self, rack_pk):
+    rack = Rack.objects.select_related('ssh_config', 'report_config').get(pk=rack_pk)
+    return archive_reports(rack, progress=lambda stats: self.update_state(state='PROGRESS', meta=dict(stats)))
+
+
+@shared_task(bind=True, name='archive_report_files_task', max_retries=settings.WATCH_FILES_MAX_RETRIES)
+def archive_report_files_task(self, rack_pk, report_names):
+    """
+    Archives the given reports of a rack, as reported by its watch, without listing the remote directory.
+    Waits for a running archive job of the rack by retrying.
+    """
+    rack = Rack.objects.select_related('ssh_config', 'report_config').filter(pk=rack_pk).first()
+    if rack is None or rack.ssh_config is None or rack.report_config is None:
+        return None
+    if claim_archive_job(rack.pk, self.request.id) is not None:
+        raise self.retry(countdown=settings.PULL_SLOT_RETRY_COUNTDOWN)
+    return archive_reports(rack, report_names=report_names)
+
+
 @shared_task(queue='celery', name='pull_reports_task')
 def pull_reports(*args, **kwargs):
-    w, created = Watchtdog.objects.get_or_create(name="test_task")
-    w.counter +=1
+    """
+    Entry point of the legacy per rack PeriodicTasks. Migrates all racks to next_pull_at, which removes those tasks,
+    and pulls the racks that are due instead of all racks. The rack whose pull time has just fired is due, because its
+    next_pull_at is computed from one dispatch interval ago.
+    """
+    w, created = Watchtdog.objects.get_or_create(name="test_task", defaults={'counter': 0})
+    w.counter += 1
     w.save()
-    print("pull reports")
-    return "pull reports"
-    # rack = Rack.objects.first()
-    # ssh_config: SshConfig = rack.ssh_config
-    # report_config: ReportConfig = rack.report_config
-    #
-    # sftp_api = get_sftp_instance_by_hostname(
-    #     hostname=ssh_config.hostname,
-    #     username=ssh_config.username,
-    #     password=ssh_config.password,
-    #     private_key=ssh_config.private_key.path if ssh_config.private_key else '',
-    #     port=ssh_config.port,
-    # )
-    #
-    # try:
-    #     if not sftp_api.is_connected:
-    #         sftp_api.connect()
-    #
-    #     sftp = sftp_api.get_sftp()
-    #     reports = [x for x in sftp.listdir(report_config.remote_report_path) if x.endswith('.html')]
-    #
-    #     remote_report_collection = []
-    #     Report = namedtuple('report', ['name', 'tag'])
-    #     _err_cnt = 0
-    #     for r in reports:
-    #         _tag = 'success'
-    #         if 'error' in r.lower():
-    #             _tag = 'danger'
-    #             _err_cnt += 1
-    #         remote_report_collection.append(Report(r, _tag))
-    #
-    # except Exception as ex:
-    #     messages.success(self.request, f"Failed to connect to {self.object.ssh_config.hostname}", extra_tags='danger')
-    #     messages.success(self.request, f"Error message: {str(ex)}", extra_tags='danger')
-    #
-    # if reports:
-    #     context['reports'] = reports
-    # return context
-    #
-    #
+
+    ReportConfig.migrate_legacy_schedules(after=timezone.now() - timedelta(seconds=settings.PULL_DISPATCH_INTERVAL))
+    return dispatch_due_pulls()
+
+
+@shared_task(name='dispatch_due_pulls_task')
+def dispatch_due_pulls():
+    """
+    Starts a pull run for the racks whose next_pull_at is due and moves their next_pull_at to the next occurrence of
+    their pull time. The update is conditional, so a rack is never dispatched twice for the same due time.
+    Racks with a running watch are not pulled.
+    """
+    now = timezone.now()
+    claimed = []
+    # get_next_pull_at reads the adaptive polling fields, deferring them would cost a query per rack
+    for report_config in ReportConfig.objects.filter(next_pull_at__lte=now).only(
+            'pk', 'pull_reports_time', 'next_pull_at', 'adaptive_polling', 'poll_interval'):
+        if ReportConfig.objects.filter(pk=report_config.pk, next_pull_at=report_config.next_pull_at) \
+                .update(next_pull_at=report_config.get_next_pull_at(now)):
+            claimed.append(report_config.pk)
+
+    rack_pks = list(Rack.objects.filter(report_config__in=claimed, ssh_config__isnull=False)
+                    .values_list('pk', flat=True))
+    watched = get_watched_racks(rack_pks)
+    return start_pull_run(rack_pk for rack_pk in rack_pks if rack_pk not in watched)
+
+
+def start_pull_run(rack_pks):
+    """
+    Archives the given racks concurrently and aggregates the results with summarize_pull_run.
+    :return: Id of the summarize task. The summary itself, if there are no racks.
+    """
+    rack_pks = list(rack_pks)
+    if not rack_pks:
+        return summarize_pull_run([], timezone.now().isoformat())
+
+    run = chord(pull_rack_reports.s(rack_pk) for rack_pk in rack_pks)
+    return run(summarize_pull_run.s(timezone.now().isoformat())).id
+
+
+@shared_task(bind=True, name='pull_rack_reports_task', max_retries=settings.PULL_SLOT_MAX_RETRIES,
+             soft_time_limit=settings.PULL_RACK_TIME_LIMIT)
+def pull_rack_reports(self, rack_pk):
+    """
+    Archives the reports of one rack as part of a pull run. Waits for a free global and per host slot by retrying, so
+    a slow or dead rack only holds up racks on the same host. Never raises, errors are part of the result.
+    """
+    result = {'rack': rack_pk, **new_progress(), 'skipped': None, 'error': None}
+    rack = Rack.objects.select_related('ssh_config', 'report_config').filter(pk=rack_pk).first()
+    if rack is None or rack.ssh_config is None or rack.report_config is None:
+        result['skipped'] = 'not configured'
+        return result
+
+    host = f'{rack.ssh_config.hostname}:{rack.ssh_config.port}'
+    global_slot = CacheSemaphore('pull', settings.PULL_MAX_CONCURRENT_RACKS, settings.PULL_RACK_TIME_LIMIT).acquire()
+    host_slot = global_slot and CacheSemaphore(f'pull-{host}', settings.PULL_MAX_CONCURRENT_PER_HOST,
+                                               settings.PULL_RACK_TIME_LIMIT).acquire()
+    if host_slot is None:
+        if global_slot is not None:
+            CacheSemaphore.release(global_slot)
+        if self.request.retries >= self.max_retries:
+            result['error'] = f'No pull slot for {host} became available.'
+            return result
+        raise self.retry(countdown=settings.PULL_SLOT_RETRY_COUNTDOWN)
+
+    try:
+        running_job_id = claim_archive_job(rack.pk, self.request.id)
+        if running_job_id is not None:
+            result['skipped'] = f'archive job {running_job_id} is running'
+            return result
+        result.update(archive_reports(
+            rack, progress=lambda stats: self.update_state(state='PROGRESS', meta=dict(stats))))
+    except Exception as ex:
+        result['error'] = str(ex)
+    finally:
+        CacheSemaphore.release(host_slot)
+        CacheSemaphore.release(global_slot)
+
+    rack.report_config.record_pull(result['rows_written'], succeeded=result['error'] is None)
+    return result
+
+
+@shared_task(name='summarize_pull_run_task')
+def summarize_pull_run(results, started_at):
+    """
+    Aggregates the results of the pull_rack_reports tasks of one pull run and caches the summary.
+    """
+    summary = {
+        'started_at': started_at,
+        'finished_at': timezone.now().isoformat(),
+        'racks': len(results),
+        'archived': sum(1 for r in results if not r['error'] and not r['skipped']),
+        'skipped': {r['rack']: r['skipped'] for r in results if r['skipped']},
+        'failed': {r['rack']: r['error'] for r in results if r['error']},
+        **{key: sum(r[key] for r in results) for key in new_progress()},
+    }
+    cache.set(LAST_PULL_RUN_KEY, summary, timeout=None)
+    return summary
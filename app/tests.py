@@ -1,3 +1,438 @@
-from django.test import TestCase
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from dashboard_racks import settings
+from .ingest import ingest_reports
+from .models import Report, ReportArchive, ReportBlob, ReportConfig, report_storage
+from .pagination import decode_token, encode_token, keyset_paginate
+from .report_parsers import GenericHtmlParser, extract_text, parse_report
+from .utils.paramiko_wrapper import ConnectError, PoolExhaustedError, SftpApi, SftpConnectionPool
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+
+class FakeSsh:
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.active = False
+
+
+class FakeSftp:
+    def close(self):
+        pass
+
+
+def fake_connect(api, keepalive_interval=0):
+    api.close()
+    api._ssh = FakeSsh()
+    api._sftp = FakeSftp()
+
+
+def fake_connect_auth_failed(api, keepalive_interval=0):
+    # like SftpApi.connect after a failed authentication, the error is only logged
+    api.close()
+    api._ssh = FakeSsh()
+
+
+class SftpConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(SftpApi, 'connect', autospec=True, side_effect=fake_connect)
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_checkin_keeps_connection_for_next_checkout(self):
+        pool = SftpConnectionPool()
+        api = pool.checkout('rack1', 'user', 'pw')
+        pool.checkin(api)
+        self.assertIs(pool.checkout('rack1', 'user', 'pw'), api)
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_connections_are_not_shared_between_credentials(self):
+        pool = SftpConnectionPool()
+        api = pool.checkout('rack1', 'user', 'pw')
+        pool.checkin(api)
+        self.assertIsNot(pool.checkout('rack1', 'user', 'other'), api)
+
+    def test_host_limit_blocks_until_checkin(self):
+        pool = SftpConnectionPool(max_connections_per_host=1, checkout_timeout=0.05)
+        api = pool.checkout('rack1', 'user', 'pw')
+        with self.assertRaises(PoolExhaustedError):
+            pool.checkout('rack1', 'user', 'pw')
+
+        threading.Timer(0.05, pool.checkin, [api]).start()
+        pool.checkout_timeout = 5
+        self.assertIs(pool.checkout('rack1', 'user', 'pw'), api)
+
+    def test_host_limit_evicts_idle_connection_with_other_credentials(self):
+        pool = SftpConnectionPool(max_connections_per_host=1, checkout_timeout=0.05)
+        api = pool.checkout('rack1', 'user', 'pw')
+        pool.checkin(api)
+        other = pool.checkout('rack1', 'user', 'other')
+        self.assertIsNot(other, api)
+        self.assertFalse(api.is_connected)
+
+    def test_least_recently_used_idle_connection_is_evicted(self):
+        pool = SftpConnectionPool(max_connections=2)
+        first = pool.checkout('rack1', 'user', 'pw')
+        second = pool.checkout('rack2', 'user', 'pw')
+        pool.checkin(first)
+        pool.checkin(second)
+
+        pool.checkout('rack3', 'user', 'pw')
+        self.assertFalse(first.is_connected)
+        self.assertTrue(second.is_connected)
+
+    def test_idle_connections_expire(self):
+        pool = SftpConnectionPool(idle_timeout=0)
+        api = pool.checkout('rack1', 'user', 'pw')
+        pool.checkin(api)
+        self.assertFalse(api.is_connected)
+        self.assertIsNot(pool.checkout('rack1', 'user', 'pw'), api)
+
+    def test_dropped_connection_is_not_kept(self):
+        pool = SftpConnectionPool()
+        api = pool.checkout('rack1', 'user', 'pw')
+        api._ssh.transport.active = False
+        pool.checkin(api)
+        self.assertIsNot(pool.checkout('rack1', 'user', 'pw'), api)
+
+    def test_failed_authentication_raises_and_frees_the_slot(self):
+        self.connect.side_effect = fake_connect_auth_failed
+        pool = SftpConnectionPool(max_connections_per_host=1, checkout_timeout=0.05)
+        for _ in range(2):
+            with self.assertRaises(ConnectError):
+                pool.checkout('rack1', 'user', 'wrong')
+
+
+class WalkTreeTests(SimpleTestCase):
+    # {directory: [(child, is directory)]}
+    TREE = {
+        'root': [('root/a', False), ('root/d1', True), ('root/d2', True)],
+        'root/d1': [('root/d1/b', False), ('root/d1/d3', True)],
+        'root/d1/d3': [('root/d1/d3/c', False)],
+        'root/d2': [],
+    }
+
+    def setUp(self):
+        self.api = SftpApi('rack1')
+        self.api._sftp = FakeSftp()
+
+        @contextmanager
+        def channels(number):
+            channel_queue = queue.Queue()
+            for _ in range(number):
+                channel_queue.put(FakeSftp())
+            yield channel_queue
+
+        patcher = mock.patch.object(self.api, '_sftp_channels', channels)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def walk(self, list_dir=None, handle_file=None, enter_dir=None, parallelism=4):
+        self.files, self.left = [], []
+        lock = threading.Lock()
+
+        def record_file(sftp, node):
+            with lock:
+                self.files.append(node)
+            return True
+
+        def leave_dir(sftp, node):
+            with lock:
+                self.left.append(node)
+            return True
+
+        return self.api._walk_tree('root', list_dir or (lambda sftp, node: self.TREE[node]),
+                                   handle_file or record_file, enter_dir, leave_dir, parallelism)
+
+    def test_all_files_are_handled_and_directories_left_after_their_entries(self):
+        for parallelism in (1, 4):
+            self.assertTrue(self.walk(parallelism=parallelism))
+            self.assertCountEqual(self.files, ['root/a', 'root/d1/b', 'root/d1/d3/c'])
+            self.assertCountEqual(self.left, self.TREE)
+            self.assertLess(self.left.index('root/d1/d3'), self.left.index('root/d1'))
+            self.assertEqual(self.left[-1], 'root')
+
+    def test_failed_listing_fails_the_walk_but_not_the_rest_of_the_tree(self):
+        self.assertFalse(self.walk(list_dir=lambda sftp, node: None if node == 'root/d1' else self.TREE[node]))
+        self.assertEqual(self.files, ['root/a'])
+        self.assertIn('root', self.left)
+
+    def test_failed_enter_dir_skips_the_subtree(self):
+        self.assertFalse(self.walk(enter_dir=lambda sftp, node: node != 'root/d1/d3'))
+        self.assertCountEqual(self.files, ['root/a', 'root/d1/b'])
+
+    def test_exception_in_callback_ends_the_walk(self):
+        def handle_file(sftp, node):
+            raise IOError('connection dropped')
+
+        self.assertFalse(self.walk(handle_file=handle_file))
+
+
+class ReportParserTests(SimpleTestCase):
+    PYTEST_HTML = (
+        b'<html><head><title>report.html</title><script>var serial = "SN-0";</script></head><body>'
+        b'<p>Report generated by <a>pytest-html</a></p>'
+        b'<p>3 tests ran in 1.50 seconds. </p>'
+        b'<span class="passed">2 passed</span>, <span class="failed">1 failed</span>'
+        b'<table id="environment"><tr><td>DUT</td><td>SN-1234</td></tr></table>'
+        b'<table id="results-table"><tbody><tr>'
+        b'<td class="col-result">Failed</td><td class="col-name">test_voltage</td>'
+        b'</tr></tbody></table></body></html>'
+    )
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def parse(self, content, report_name='2023-01-31_12-00-00_Testresult.html'):
+        path = os.path.join(self.tmp_dir, report_name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return parse_report(path, report_name)
+
+    def test_pytest_html_report(self):
+        summary, parser = self.parse(self.PYTEST_HTML)
+        self.assertEqual(parser, 'pytest-html')
+        self.assertEqual(summary['verdict'], 'FAILED')
+        self.assertEqual(summary['tests_total'], 3)
+        self.assertEqual(summary['tests_failed'], 1)
+        self.assertEqual(summary['duration'], timedelta(seconds=1.5))
+        self.assertEqual(summary['dut'], 'SN-1234')
+        self.assertEqual(summary['failures'], ['test_voltage'])
+
+    def test_text_excludes_scripts(self):
+        summary, _ = self.parse(self.PYTEST_HTML)
+        self.assertIn('SN-1234', summary['text'])
+        self.assertNotIn('SN-0', summary['text'])
+
+    def test_generic_report(self):
+        summary, parser = self.parse(b'<p>Duration: 2 min</p><p>12 passed</p><p>0 failed</p><p>DUT: ABC-1</p>')
+        self.assertEqual(parser, 'generic')
+        self.assertEqual(summary['verdict'], 'PASSED')
+        self.assertEqual(summary['tests_total'], 12)
+        self.assertEqual(summary['tests_failed'], 0)
+        self.assertEqual(summary['duration'], timedelta(minutes=2))
+        self.assertEqual(summary['dut'], 'ABC-1')
+
+    def test_generic_parser_ignores_digits_inside_words(self):
+        parser = GenericHtmlParser()
+        parser.feed('DUT: XY9 error in 2 tests')
+        parser.close()
+        self.assertIsNone(parser.summary['tests_failed'])
+        self.assertIsNone(parser.summary['verdict'])
+
+    def test_inconsistent_counts_fall_back_to_the_report_name(self):
+        summary, _ = self.parse(b'<p>5 failed</p><p>2 tests</p>')
+        self.assertIsNone(summary['tests_failed'])
+        self.assertEqual(summary['verdict'], 'PASSED')
+
+    def test_unparsable_report_falls_back_to_the_report_name(self):
+        summary, parser = self.parse(b'', '2023-01-31_12-00-00_Testresult_error.html')
+        self.assertEqual(summary['verdict'], 'FAILED')
+
+    def test_extract_text(self):
+        with open(os.path.join(self.tmp_dir, 'report.html'), 'wb') as f:
+            f.write(b'<style>p {}</style><p>Hello</p>\n <b>world</b>')
+        with open(os.path.join(self.tmp_dir, 'report.html'), 'rb') as f:
+            self.assertEqual(extract_text(f), 'Hello world')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.archive = ReportArchive.objects.create(name='rack1')
+        start = timezone.now()
+        created = [None, None, start, start, start + timedelta(hours=1), start + timedelta(hours=2), start,
+                   start + timedelta(hours=3)]
+        Report.objects.bulk_create([Report(archive=self.archive, name=f'{i}.html', created=c)
+                                    for i, c in enumerate(created)])
+        self.ordered = sorted(Report.objects.all(), key=lambda r: (r.created is not None, r.created or start, r.pk))
+
+    def pages_forward(self, page_size):
+        pages, after = [], None
+        while True:
+            page = keyset_paginate(Report.objects.all(), page_size, after=after)
+            pages.append(page)
+            if page.next_token is None:
+                return pages
+            after = page.next_token
+
+    def test_token_round_trip(self):
+        for report in self.ordered[:3]:
+            self.assertEqual(decode_token(encode_token(report)), (report.created, report.pk))
+        self.assertIsNone(decode_token('not a token'))
+
+    def test_forward_pages_cover_all_reports_in_order(self):
+        pages = self.pages_forward(3)
+        self.assertEqual([report for page in pages for report in page.items], self.ordered)
+        self.assertEqual([len(page.items) for page in pages], [3, 3, 2])
+        self.assertIsNone(pages[0].prev_token)
+
+    def test_backward_pages_return_the_previous_page(self):
+        pages = self.pages_forward(3)
+        for previous, page in zip(pages, pages[1:]):
+            back = keyset_paginate(Report.objects.all(), 3, before=page.prev_token)
+            self.assertEqual(back.items, previous.items)
+        first = keyset_paginate(Report.objects.all(), 3, before=pages[1].prev_token)
+        self.assertIsNone(first.prev_token)
+        self.assertIsNotNone(first.next_token)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReportBlobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.archive = ReportArchive.objects.create(name='rack1')
+        self.staging = os.path.join(self.media_root, 'rack1')
+        os.makedirs(self.staging)
+
+    def stage(self, name, content):
+        with open(os.path.join(self.staging, name), 'w') as f:
+            f.write(content)
+        return name
+
+    def ingest(self, names):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ingest_reports(self.archive, self.staging, names)
+
+    def test_references_are_counted_per_occurrence(self):
+        ReportBlob.add_references(['a', 'a', 'b'])
+        ReportBlob.add_references(['b'])
+        self.assertEqual(dict(ReportBlob.objects.values_list('name', 'refcount')), {'a': 2, 'b': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ReportBlob.remove_references(['a', 'a', 'b'])
+        self.assertEqual(dict(ReportBlob.objects.values_list('name', 'refcount')), {'b': 1})
+
+    def test_orphan_referenced_again_is_kept(self):
+        ReportBlob.objects.create(name='a', refcount=1)
+        ReportBlob.delete_orphan('a')
+        self.assertTrue(ReportBlob.objects.filter(name='a').exists())
+
+    def test_ingest_shares_blobs_and_counts_reports(self):
+        names = [
+            self.stage('2023-01-01_12-00-00_Testresult.html', '<p>Result: passed</p>'),
+            self.stage('2023-01-02_12-00-00_Testresult.html', '<p>Result: passed</p>'),
+            self.stage('2023-01-03_12-00-00_Testresult.html', '<p>Result: failed</p>'),
+        ]
+        self.assertEqual(self.ingest(names), 3)
+        self.assertEqual(os.listdir(self.staging), [])
+
+        reports = list(Report.objects.order_by('name'))
+        self.assertEqual(reports[0].file.name, reports[1].file.name)
+        self.assertEqual(sorted(ReportBlob.objects.values_list('refcount', flat=True)), [1, 2])
+        self.assertTrue(all(report_storage.exists(report.file.name) for report in reports))
+
+        self.archive.refresh_from_db()
+        self.assertEqual((self.archive.reports_total, self.archive.reports_passed, self.archive.reports_failed),
+                         (3, 2, 1))
+        self.assertEqual(self.archive.last_report_at, reports[2].created)
+
+        # reports already in the archive are skipped and not counted again
+        self.stage(names[0], '<p>Result: passed</p>')
+        self.assertEqual(self.ingest([names[0]]), 0)
+        self.archive.refresh_from_db()
+        self.assertEqual(self.archive.reports_total, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Report.objects.filter(pk=reports[2].pk).delete()
+            ReportBlob.remove_references([reports[2].file.name])
+            ReportArchive.remove_from_stats([reports[2]])
+        self.archive.refresh_from_db()
+        self.assertEqual((self.archive.reports_total, self.archive.reports_passed, self.archive.reports_failed),
+                         (2, 2, 0))
+        self.assertEqual(self.archive.last_report_at, reports[1].created)
+        self.assertFalse(report_storage.exists(reports[2].file.name))
+
+    def test_failed_ingest_keeps_the_staged_files(self):
+        name = self.stage('2023-01-01_12-00-00_Testresult.html', '<p>Result: passed</p>')
+        with mock.patch('app.ingest.index_reports', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                self.ingest([name])
+        self.assertEqual(os.listdir(self.staging), [name])
+        self.assertFalse(ReportBlob.objects.exists())
+
+    def test_deleting_the_archive_releases_its_blobs(self):
+        self.ingest([self.stage('2023-01-01_12-00-00_Testresult.html', '<p>Result: passed</p>')])
+        name = Report.objects.get().file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.archive.delete()
+        self.assertFalse(ReportBlob.objects.exists())
+        self.assertFalse(report_storage.exists(name))
+
+
+class ReportConfigScheduleTests(TestCase):
+    def setUp(self):
+        self.tz = ZoneInfo(settings.CELERY_TIMEZONE)
+        self.now = datetime(2023, 1, 31, 12, 0, tzinfo=self.tz)
+
+    def test_next_pull_at_pull_reports_time(self):
+        report_config = ReportConfig(pull_reports_time=time(13, 30))
+        self.assertEqual(report_config.get_next_pull_at(self.now), datetime(2023, 1, 31, 13, 30, tzinfo=self.tz))
+
+        report_config.pull_reports_time = time(12, 0)
+        self.assertEqual(report_config.get_next_pull_at(self.now), datetime(2023, 2, 1, 12, 0, tzinfo=self.tz))
+
+        report_config.pull_reports_time = None
+        self.assertIsNone(report_config.get_next_pull_at(self.now))
+
+    def test_next_pull_at_adaptive_polling(self):
+        report_config = ReportConfig(adaptive_polling=True, poll_interval=600)
+        self.assertEqual(report_config.get_next_pull_at(self.now), self.now + timedelta(seconds=600))
+
+    def test_empty_pulls_back_off_up_to_the_maximum(self):
+        report_config = ReportConfig.objects.create(adaptive_polling=True, poll_interval=600, max_poll_interval=1800)
+        report_config.record_pull(0, now=self.now)
+        self.assertEqual(report_config.poll_interval, 600 * settings.ADAPTIVE_POLL_BACKOFF)
+        report_config.record_pull(0, now=self.now)
+        report_config.record_pull(0, succeeded=False, now=self.now)
+        self.assertEqual(report_config.poll_interval, 1800)
+        self.assertEqual(report_config.empty_poll_streak, 3)
+        self.assertEqual(report_config.next_pull_at, self.now + timedelta(seconds=1800))
+
+    def test_busy_rack_is_polled_more_often(self):
+        report_config = ReportConfig.objects.create(adaptive_polling=True, poll_interval=3600, min_poll_interval=60,
+                                                    last_pulled_at=self.now - timedelta(hours=1))
+        report_config.record_pull(1000, now=self.now)
+        report_config.refresh_from_db()
+
+        rate = settings.ADAPTIVE_POLL_RATE_SMOOTHING * 1000
+        self.assertAlmostEqual(report_config.arrival_rate, rate)
+        self.assertEqual(report_config.poll_interval, max(int(settings.ADAPTIVE_POLL_TARGET_BATCH / rate * 3600), 60))
+        self.assertEqual(report_config.empty_poll_streak, 0)
+        self.assertEqual(report_config.last_pulled_at, self.now)
+
+    def test_fixed_schedule_keeps_next_pull_at(self):
+        next_pull_at = self.now + timedelta(days=1)
+        report_config = ReportConfig.objects.create(pull_reports_time=time(12, 0), next_pull_at=next_pull_at)
+        report_config.record_pull(0, now=self.now)
+        report_config.refresh_from_db()
+        self.assertEqual(report_config.next_pull_at, next_pull_at)
@@ -24,9 +24,11 @@ urlpatterns = [
 
     # SSH COMMANDS
     path('rack/<int:rack_pk>/sftp/move_all/', api.archive_reports, name='rack-download-report'),
+    path('rack/<int:rack_pk>/sftp/move_all/status/', api.archive_status, name='rack-archive-status'),
 
     # REPORTS
     path('rack/<int:rack_pk>/report/<int:pk>/detail/', views.ReportDetailView.as_view(), name='rack-report-detail'),
+    path('rack/<int:rack_pk>/report/<int:pk>/file/', views.ReportFileView.as_view(), name='rack-report-file'),
     path('rack/<int:rack_pk>/report/<int:pk>/delete/', views.ReportDeleteView.as_view(), name='rack-report-delete'),
     path('rack/<int:rack_pk>/reports/delete/selected/', api.delete_selected_reports, name='rack-reports-delete-selected'),
     path('rack/<int:rack_pk>/reports/filtered', views.ReportFilteredListView.as_view(), name='rack-report-list-filtered'),
@@ -1,17 +1,27 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+import queue
 import re
+import shlex
+import shutil
+import socket
 import sys
+import tarfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from stat import S_ISDIR, S_ISREG
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import paramiko
 
 import logging
 
-sftp_instances = {}  # {'hostname' : SftpApiInstance}
-
 logger = logging.getLogger('paramiko_wrapper')
 
 DEFAULT_PATH_SEP = "/"
@@ -23,27 +33,247 @@ MKDIR_REMOTE_ERROR = "Could not create directory '{0}' on remote system."
 MKDIR_LOCAL_ERROR = "Could not create directory '{0}' on local system."
 DELETE_FROM_REMOTE_ERROR = "Could not delete remote file '{0}'."
 NO_FILE_MATCHING_ERROR = "No file matching pattern '{0}' in remote directory '{1}'."
+OPEN_CHANNEL_ERROR = "Could not open additional SFTP channel, continuing with {0} channel(s)."
 FUNCTION_ABORTED = "{0} aborted."
 CONTINUING = "Continuing with other directory entries."
 IO_ERROR = "IO Error: {0}"
 OS_ERROR = "OS Error: {0}"
 IO_OS_ERROR = "IO/OS Error: {0}"
 SSH_EXCEPTION = "SSHException: {0}"
+EXEC_FAILED = "Remote command '{0}' failed with exit status {1}: {2}"
+MANIFEST_ERROR = "Could not read sync manifest '{0}', syncing all files."
+SYNC_SUMMARY = "Synced '{0}' to '{1}': {2} fetched, {3} unchanged, {4} deleted, {5} failed."
+TAR_STREAM_ERROR = "Could not receive tar stream of remote directory '{0}': {1}"
+CHECKSUM_MISMATCH = "Checksum of local copy '{0}' does not match remote file '{1}', keeping the remote file."
+WATCH_ENDED = "Watch of remote directory '{0}' ended with exit status {1}."
+POOL_EXHAUSTED_ERROR = "No SFTP connection to '{0}' became available within {1} seconds."
+CONNECT_ERROR = "Could not open an SFTP session to '{0}:{1}'."
+
+DEFAULT_KEEPALIVE_INTERVAL = 30  # seconds between SSH keepalive packets
+DEFAULT_IDLE_TIMEOUT = 300  # seconds an unused pooled connection is kept open
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_CHECKOUT_TIMEOUT = 60  # seconds to wait for a free connection slot
+DEFAULT_PARALLELISM = 1  # number of SFTP channels used by transfers that support concurrency
+TRANSFER_MODE_SFTP = 'sftp'  # one SFTP get per file
+TRANSFER_MODE_TAR = 'tar'  # one gzipped tar stream per directory, unpacked while it arrives
+PARTIAL_SUFFIX = '.part'  # suffix of files being downloaded, interrupted downloads resume from them
+PARTIAL_STATE_SUFFIX = '.json'  # suffix of the file next to a partial download with the size and mtime of its source
+TRANSFER_CHUNK_SIZE = 1024 * 1024  # bytes written to a partial download at once
+MANIFEST_NAME = '.sftp_manifest.json'  # file in the local directory of sync_dir_from_remote
+HASH_BATCH_SIZE = 200  # remote files hashed per sha256sum command
+
+
+class PoolExhaustedError(paramiko.SSHException):
+    """
+    Raised if no pooled connection to a host becomes available within the checkout timeout.
+    """
 
 
-def get_sftp_instance_by_hostname(hostname, username, password, private_key=None, port=22):
-    global sftp_instances
-    return (
-        SftpApi(
-            remote_ip=hostname,
-            username=username,
-            password=password,
-            private_key=private_key or '',
-            port=port,
-        )
-        if hostname not in sftp_instances.keys()
-        else sftp_instances.get(hostname)
-    )
+class ConnectError(paramiko.SSHException):
+    """
+    Raised if a pooled connection could not be opened, e.g. because the authentication failed.
+    """
+
+
+def credential_fingerprint(password: (str | None) = None, private_key: (str | None) = None) -> str:
+    """
+    Builds a fingerprint of the credentials, so pooled connections are never shared between different credentials and
+    the credentials themselves are not kept in the pool keys.
+    :param password:    SSH password.
+    :param private_key: SSH private key file.
+    :return: Hex digest of the credentials.
+    """
+    digest = hashlib.sha256()
+    digest.update((password or '').encode())
+    digest.update(b'\0')
+    digest.update((private_key or '').encode())
+    if private_key and os.path.exists(private_key):
+        digest.update(str(os.path.getmtime(private_key)).encode())
+    return digest.hexdigest()
+
+
+class SftpConnectionPool:
+    """
+    Thread-safe pool of connected SftpApi instances keyed by (host, port, user, credential fingerprint).
+    Idle connections are closed after idle_timeout seconds or evicted least recently used first once max_connections is
+    reached. At most max_connections_per_host connections are opened to the same host and port, further checkouts wait
+    for a checkin. Connections that dropped while idle are reconnected transparently on checkout.
+    """
+
+    def __init__(self, max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 keepalive_interval: int = DEFAULT_KEEPALIVE_INTERVAL,
+                 checkout_timeout: float = DEFAULT_CHECKOUT_TIMEOUT):
+        """
+        :param max_connections_per_host: Maximum number of open connections (idle and checked out) per host and port.
+        :param max_connections:          Maximum number of open connections in total.
+        :param idle_timeout:             Seconds after which an idle connection is closed.
+        :param keepalive_interval:       Seconds between SSH keepalive packets, 0 disables keepalives.
+        :param checkout_timeout:         Seconds to wait for a free connection before PoolExhaustedError is raised.
+        """
+        self.max_connections_per_host = max_connections_per_host
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.checkout_timeout = checkout_timeout
+        self._condition = threading.Condition()
+        self._idle: OrderedDict[int, tuple[SftpApi, float]] = OrderedDict()  # {id(api): (api, last_used)}, LRU first
+        self._host_counts: dict[tuple[str, int], int] = {}  # {(host, port): number of open connections}
+
+    @staticmethod
+    def _pool_key(hostname: str, username: str, password: (str | None), private_key: (str | None), port: int) -> tuple:
+        return hostname, port, username, credential_fingerprint(password, private_key)
+
+    def _open_connections(self) -> int:
+        return sum(self._host_counts.values())
+
+    def _discard(self, api: SftpApi):
+        """
+        Forgets a connection and frees its host slot. Must be called with the condition held.
+        """
+        self._idle.pop(id(api), None)
+        host = api.pool_key[:2]
+        self._host_counts[host] -= 1
+        if self._host_counts[host] <= 0:
+            del self._host_counts[host]
+        api.close()
+        self._condition.notify_all()
+
+    def _evict_expired(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for api, last_used in list(self._idle.values()):
+            if last_used < deadline:
+                self._discard(api)
+
+    def _evict_lru(self, host: (tuple[str, int] | None) = None) -> bool:
+        """
+        Closes the least recently used idle connection, optionally only one to the given host.
+        :return: True, if a connection was evicted. False, otherwise.
+        """
+        for api, _ in self._idle.values():
+            if host is None or api.pool_key[:2] == host:
+                self._discard(api)
+                return True
+        return False
+
+    @staticmethod
+    def _is_usable(api: SftpApi) -> bool:
+        # connect() only logs SSH errors, a failed authentication leaves an active transport without SFTP client
+        return api.is_connected and api._sftp is not None
+
+    def _take_idle(self, key: tuple) -> SftpApi | None:
+        for api, _ in reversed(list(self._idle.values())):
+            if api.pool_key != key:
+                continue
+            if not self._is_usable(api):
+                self._discard(api)
+                continue
+            del self._idle[id(api)]
+            return api
+        return None
+
+    def checkout(self, hostname: str, username: str = "", password: (str | None) = None,
+                 private_key: (str | None) = None, port: int = 22) -> SftpApi:
+        """
+        Checks out a connected SftpApi from the pool, opening a new connection if no idle one matches.
+        Every checkout has to be followed by a checkin, preferably through connection().
+        :raises PoolExhaustedError: If the host connection limit stays reached for checkout_timeout seconds.
+        """
+        key = self._pool_key(hostname, username, password, private_key, port)
+        host = key[:2]
+        deadline = time.monotonic() + self.checkout_timeout
+
+        with self._condition:
+            while True:
+                self._evict_expired()
+                api = self._take_idle(key)
+                if api is not None:
+                    break
+                if self._host_counts.get(host, 0) >= self.max_connections_per_host:
+                    # idle connections to the same host with other credentials make room first
+                    if self._evict_lru(host):
+                        continue
+                elif self._open_connections() < self.max_connections or self._evict_lru():
+                    self._host_counts[host] = self._host_counts.get(host, 0) + 1
+                    api = SftpApi(remote_ip=hostname, username=username, password=password,
+                                  private_key=private_key or '', port=port)
+                    api.pool_key = key
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(POOL_EXHAUSTED_ERROR.format(hostname, self.checkout_timeout))
+                self._condition.wait(remaining)
+
+        if not self._is_usable(api):
+            try:
+                api.connect(keepalive_interval=self.keepalive_interval)
+                if not self._is_usable(api):
+                    raise ConnectError(CONNECT_ERROR.format(hostname, port))
+            except BaseException:
+                with self._condition:
+                    self._discard(api)
+                raise
+        return api
+
+    def checkin(self, api: SftpApi):
+        """
+        Returns a checked out SftpApi to the pool. Connections that dropped are closed instead of kept idle.
+        """
+        with self._condition:
+            if self._is_usable(api):
+                self._idle[id(api)] = (api, time.monotonic())
+                self._condition.notify_all()
+            else:
+                self._discard(api)
+            self._evict_expired()
+
+    @contextmanager
+    def connection(self, hostname: str, username: str = "", password: (str | None) = None,
+                   private_key: (str | None) = None, port: int = 22) -> Iterator[SftpApi]:
+        """
+        Context manager checking a connection out of the pool and back in on exit.
+        """
+        api = self.checkout(hostname, username, password, private_key, port)
+        try:
+            yield api
+        finally:
+            self.checkin(api)
+
+    def close_all(self):
+        """
+        Closes all idle connections. Checked out connections are closed on their checkin.
+        """
+        with self._condition:
+            for api, _ in list(self._idle.values()):
+                self._discard(api)
+
+
+sftp_pool = SftpConnectionPool()
+
+
+def get_sftp_instance_by_hostname(hostname, username, password, private_key=None, port=22) -> SftpApi:
+    """
+    Checks a connected SftpApi out of the module wide connection pool.
+    Hand it back with release_sftp_instance or use sftp_instance as a context manager instead.
+    """
+    return sftp_pool.checkout(hostname=hostname, username=username, password=password, private_key=private_key,
+                              port=port)
+
+
+def release_sftp_instance(sftp_api: SftpApi):
+    """
+    Returns an SftpApi from get_sftp_instance_by_hostname to the connection pool.
+    """
+    sftp_pool.checkin(sftp_api)
+
+
+def sftp_instance(hostname, username, password, private_key=None, port=22):
+    """
+    Context manager version of get_sftp_instance_by_hostname, returning the connection to the pool on exit.
+    """
+    return sftp_pool.connection(hostname=hostname, username=username, password=password, private_key=private_key,
+                                port=port)
 
 
 def _create_local_dir(local_dir: str, calling_function: str) -> bool:
@@ -64,12 +294,91 @@ def _create_local_dir(local_dir: str, calling_function: str) -> bool:
     return True
 
 
+def _exec_path(path: str) -> str:
+    """
+    Turns a remote path into one usable without shell expansion by commands run in the home directory.
+    """
+    if path == '~':
+        return '.'
+    return path[2:] if path.startswith('~/') else path
+
+
+def _shell_path(path: str) -> str:
+    """
+    Quotes a remote path for a POSIX shell, keeping a leading '~/' expandable.
+    """
+    if path == '~' or path.startswith('~/'):
+        return '"$HOME"' + (shlex.quote(path[1:]) if len(path) > 1 else '')
+    return shlex.quote(path)
+
+
+def _read_manifest(manifest_path: str) -> dict[str, list]:
+    """
+    :return: {relative path: [size, mtime, sha256 or None]} from a sync manifest. Empty, if there is none.
+    """
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)['files']
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError) as err:
+        logger.warning(MANIFEST_ERROR.format(manifest_path))
+        logger.warning(IO_OS_ERROR.format(err))
+        return {}
+
+
+def _write_manifest(manifest_path: str, files: dict[str, list]):
+    with open(manifest_path + PARTIAL_SUFFIX, 'w') as f:
+        json.dump({'version': 1, 'files': files}, f)
+    os.replace(manifest_path + PARTIAL_SUFFIX, manifest_path)
+
+
+def _read_partial_state(state_path: str) -> dict | None:
+    """
+    :return: {'size': ..., 'mtime': ...} of the remote file a partial download was started from. None, if unknown.
+    """
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _local_matches(local_path: str, size: int, mtime: (int | None) = None) -> bool:
+    """
+    :return: True, if the local file exists with the given size and, if given, modification time.
+    """
+    try:
+        stat = os.stat(local_path)
+    except OSError:
+        return False
+    return stat.st_size == size and (mtime is None or int(stat.st_mtime) == mtime)
+
+
+def _sha256_file(local_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def listing_watermark(entries: list[paramiko.SFTPAttributes]) -> tuple[int, str] | None:
+    """
+    :param entries: Entries as returned by SftpApi.list_pattern_on_remote.
+    :return: Watermark (modification time, file name) of the last entry. None, if there are no entries.
+    """
+    if not entries:
+        return None
+    return int(entries[-1].st_mtime or 0), entries[-1].filename
+
+
 class SftpApi:
     _ssh: paramiko.SSHClient | None
     _sftp: paramiko.SFTPClient | None
 
     def __init__(self, remote_ip: str, username: str = "", password: (str | None) = None,
-                 private_key: (str | None) = None, port: int = 22):
+                 private_key: (str | None) = None, port: int = 22, cache_ttl: float = 0):
         """
         Initialises the SftpApi, tries to establish a connection with the SSH/SFTP server.
         :param remote_ip:   Host IP.
@@ -77,6 +386,8 @@ class SftpApi:
         :param password:    SSH password (leave None if you use a private key file).
         :param private_key: SSH private key file (leave None if you use a password).
         :param port:        SSH port.
+        :param cache_ttl:   Seconds stat and listing results are cached, 0 disables the cache. Writes and deletes through
+                            this SftpApi invalidate the affected entries, changes made by others show up after cache_ttl.
         """
         self._ssh = None
         self._sftp = None
@@ -85,8 +396,19 @@ class SftpApi:
         self.username = username
         self.password = password
         self.port = port
+        self.pool_key = None
+        self.cache_ttl = cache_ttl
+        self._cache_lock = threading.Lock()
+        self._stat_cache: dict[str, tuple[float, paramiko.SFTPAttributes | None]] = {}
+        self._listdir_cache: dict[str, tuple[float, list[paramiko.SFTPAttributes]]] = {}
 
-    def connect(self):
+    def connect(self, keepalive_interval: int = 0):
+        """
+        Connects to the SSH/SFTP server, closing a previous connection first.
+        :param keepalive_interval: Seconds between SSH keepalive packets, 0 disables keepalives.
+        """
+        self.close()
+        self.clear_cache()
         try:
             self._ssh = paramiko.SSHClient()
             self._ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy)
@@ -97,6 +419,8 @@ class SftpApi:
                 key = paramiko.RSAKey.from_private_key_file(self.private_key)
                 self._ssh.connect(hostname=self.remote_ip, username=self.username, pkey=key, port=self.port,
                                   disabled_algorithms=dict(pubkeys=["rsa-sha2-512", "rsa-sha2-256"]))
+            if keepalive_interval:
+                self._ssh.get_transport().set_keepalive(keepalive_interval)
             self._sftp = self._ssh.open_sftp()
         except paramiko.SSHException as e:
             logger.warning(SSH_EXCEPTION.format(e))
@@ -108,14 +432,19 @@ class SftpApi:
         else:
             return False
 
-    def __del__(self):
+    def close(self):
         """
         Closes the SFTP and SSH connections.
         """
         if self._sftp is not None:
             self._sftp.close()
+            self._sftp = None
         if self._ssh is not None:
             self._ssh.close()
+            self._ssh = None
+
+    def __del__(self):
+        self.close()
 
     def copy_file_to_remote(self, remote_path: str, local_path: str) -> bool:
         """
@@ -130,6 +459,7 @@ class SftpApi:
 
         try:
             sftp.put(localpath=local_path, remotepath=remote_path)
+            self._invalidate(remote_path)
             return True
         except (IOError, OSError) as err:
             logger.warning(COPY_FROM_LOCAL_ERROR.format(local_path, remote_path))
@@ -138,7 +468,7 @@ class SftpApi:
 
     def copy_file_from_remote(self, remote_path: str, local_path: str) -> bool:
         """
-        Copies a remote file to the local system.
+        Copies a remote file to the local system. An interrupted copy resumes where it stopped when repeated.
         :param remote_path: Path to the file on the remote system.
         :param local_path:  Destination path on the local system (including file name and file ending!).
         :return True, if the operation was successful. False, if at least one Error has occurred.
@@ -150,24 +480,21 @@ class SftpApi:
         if not _create_local_dir(os.path.dirname(local_path), self.copy_file_from_remote.__name__):
             return False
 
-        try:
-            local_file_path = os.path.abspath(os.path.join(local_path, os.path.basename(remote_path)))
-            sftp.get(remotepath=remote_path, localpath=local_file_path)
-        except IOError as err:
-            logger.warning(COPY_FROM_REMOTE_ERROR.format(remote_path, local_path))
-            logger.warning(IO_ERROR.format(err))
-            return False
-        return True
+        local_file_path = os.path.abspath(os.path.join(local_path, os.path.basename(remote_path)))
+        return self._get_file(sftp, remote_path, local_file_path)
 
     def copy_dir_to_remote(self, remote_dir: str, local_dir: str, remote_path_sep: str = DEFAULT_PATH_SEP,
-                           ignore_regex: (Iterable[re.Pattern] | Iterable[str] | None) = None) -> bool:
+                           ignore_regex: (Iterable[re.Pattern] | Iterable[str] | None) = None,
+                           parallelism: int = DEFAULT_PARALLELISM) -> bool:
         """
-        Recursively copies a local directory to the remote system.
+        Recursively copies a local directory to the remote system. Subdirectories are walked breadth first and copied
+        concurrently.
         :param remote_dir:      Remote destination path for the copy operation.
         :param local_dir:       Path to the local directory to be copied.
         :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
         :param ignore_regex:    Local files/directories whose base name matches any of the regular expressions in
                                 ignore_regex are ignored.
+        :param parallelism:     Number of SFTP channels used concurrently.
         :return True, if the operation was successful. False, if at least one Error has occurred.
         """
         sftp = self._check_sftp(self.copy_dir_to_remote.__name__)
@@ -180,6 +507,7 @@ class SftpApi:
         if not self.exists(remote_dir):
             try:
                 sftp.mkdir(remote_dir)
+                self._invalidate(remote_dir)
             except OSError as err:
                 logger.warning(MKDIR_REMOTE_ERROR.format(remote_dir))
                 logger.warning(OS_ERROR.format(err))
@@ -189,39 +517,49 @@ class SftpApi:
         if any(re.match(regex, os.path.basename(local_dir)) for regex in ignore_regex):
             return True
 
-        success = True
-        for entry in os.listdir(local_dir):
-            remote_path = remote_dir + remote_path_sep + entry
-            local_path = os.path.join(local_dir, entry)
+        def enter_dir(channel: paramiko.SFTPClient, node: tuple[str, str]) -> bool:
+            remote_path, _ = node
+            if node[0] == remote_dir or self._stat(channel, remote_path) is not None:
+                return True
+            try:
+                channel.mkdir(remote_path)
+                self._invalidate(remote_path)
+            except OSError as err:
+                logger.warning(MKDIR_REMOTE_ERROR.format(remote_path))
+                logger.warning(OS_ERROR.format(err))
+                logger.warning(CONTINUING)
+                return False
+            return True
 
-            if any(re.match(regex, os.path.basename(local_path)) for regex in ignore_regex):
-                continue
+        def list_dir(channel: paramiko.SFTPClient, node: tuple[str, str]) -> list[tuple[tuple[str, str], bool]] | None:
+            remote_path, local_path = node
+            try:
+                entries = os.listdir(local_path)
+            except OSError as err:
+                logger.warning(OS_ERROR.format(err))
+                return None
+            return [((remote_path + remote_path_sep + entry, os.path.join(local_path, entry)),
+                     not os.path.isfile(os.path.join(local_path, entry)))
+                    for entry in entries if not any(re.match(regex, entry) for regex in ignore_regex)]
 
-            if not os.path.isfile(local_path):
-                if not self.exists(remote_path):
-                    try:
-                        sftp.mkdir(remote_path)
-                    except OSError as err:
-                        logger.warning(MKDIR_REMOTE_ERROR.format(remote_path))
-                        logger.warning(OS_ERROR.format(err))
-                        logger.warning(CONTINUING)
-                        success = False
-                        continue
-                self.copy_dir_to_remote(remote_path, local_path, remote_path_sep, ignore_regex)
-            else:
-                success = self.copy_file_to_remote(remote_path, local_path) and success
+        def put_file(channel: paramiko.SFTPClient, node: tuple[str, str]) -> bool:
+            return self._put_file(channel, node[1], node[0])
 
-        return success
+        return self._walk_tree((remote_dir, local_dir), list_dir, put_file, enter_dir=enter_dir,
+                               parallelism=parallelism)
 
     def copy_dir_from_remote(self, remote_dir: str, local_dir: str, remote_path_sep: str = DEFAULT_PATH_SEP,
-                             ignore_regex: (Iterable[re.Pattern] | Iterable[str] | None) = None) -> bool:
+                             ignore_regex: (Iterable[re.Pattern] | Iterable[str] | None) = None,
+                             parallelism: int = DEFAULT_PARALLELISM) -> bool:
         """
-        Recursively copies a remote directory to the local system.
+        Recursively copies a remote directory to the local system. Subdirectories are walked breadth first and copied
+        concurrently.
         :param remote_dir:      Remote destination path for the copy operation.
         :param local_dir:       Path to the local directory to be copied.
         :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
         :param ignore_regex:    Remote files/directories whose base name matches any of the regular expressions in
                                 ignore_regex are ignored.
+        :param parallelism:     Number of SFTP channels used concurrently.
         :return True, if the operation was successful. False, if at least one Error has occurred.
         """
         sftp = self._check_sftp(self.copy_dir_from_remote.__name__)
@@ -237,29 +575,190 @@ class SftpApi:
         if any(re.match(regex, remote_dir.rsplit(remote_path_sep)[0]) for regex in ignore_regex):
             return True
 
-        success = True
-        for entry in sftp.listdir_attr(remote_dir):
-            remote_path = remote_dir + remote_path_sep + entry.filename
-            local_path = os.path.join(local_dir, entry.filename)
+        def enter_dir(channel: paramiko.SFTPClient, node: tuple[str, str]) -> bool:
+            _, local_path = node
+            if local_path == local_dir:
+                return True
+            try:
+                os.mkdir(local_path)
+            except OSError as err:
+                logger.warning(MKDIR_LOCAL_ERROR.format(local_path))
+                logger.warning(OS_ERROR.format(err))
+                logger.warning(CONTINUING)
+                return False
+            return True
+
+        def list_dir(channel: paramiko.SFTPClient, node: tuple[str, str]) -> list[tuple[tuple[str, str], bool]] | None:
+            remote_path, local_path = node
+            entries = self._list_remote_dir(channel, remote_path, remote_path_sep)
+            if entries is None:
+                return None
+            return [((remote_path + remote_path_sep + entry.filename, os.path.join(local_path, entry.filename)),
+                     S_ISDIR(entry.st_mode))
+                    for entry in entries if not any(re.match(regex, entry.filename) for regex in ignore_regex)
+                    and (S_ISDIR(entry.st_mode) or S_ISREG(entry.st_mode))]
+
+        def get_file(channel: paramiko.SFTPClient, node: tuple[str, str]) -> bool:
+            return self._get_file(channel, node[0], node[1])
+
+        return self._walk_tree((remote_dir, local_dir), list_dir, get_file, enter_dir=enter_dir,
+                               parallelism=parallelism)
+
+    def sync_dir_from_remote(self, remote_dir: str, local_dir: str, remote_path_sep: str = DEFAULT_PATH_SEP,
+                             ignore_regex: (Iterable[re.Pattern] | Iterable[str] | None) = None,
+                             mirror_deletions: bool = False, checksum: bool = False,
+                             parallelism: int = DEFAULT_PARALLELISM) -> bool:
+        """
+        Delta sync version of copy_dir_from_remote. A manifest of (path, size, mtime, optional sha256) in the local
+        directory records what has been synced, so only new and modified files are downloaded. Downloaded files get the
+        modification time of their remote file.
+        :param remote_dir:       Remote directory to be synced.
+        :param local_dir:        Local destination directory.
+        :param remote_path_sep:  Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param ignore_regex:     Remote files/directories whose base name matches any of the regular expressions in
+                                 ignore_regex are ignored.
+        :param mirror_deletions: Delete local files synced before whose remote file is gone.
+        :param checksum:         Record the sha256 of synced files. Files whose size matches but whose mtime changed are
+                                 then compared by a remote sha256sum and only downloaded if their content changed.
+        :param parallelism:      Number of SFTP channels downloading files concurrently.
+        :return True, if the operation was successful. False, if at least one Error has occurred.
+        """
+        sftp = self._check_sftp(self.sync_dir_from_remote.__name__)
+        if sftp is None:
+            return False
+
+        if not _create_local_dir(local_dir, self.sync_dir_from_remote.__name__):
+            return False
+
+        manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+        manifest = _read_manifest(manifest_path)
+        remote_files = self._walk_remote(remote_dir, remote_path_sep, ignore_regex or [], parallelism)
+        if remote_files is None:
+            logger.warning(FUNCTION_ABORTED.format(self.sync_dir_from_remote.__name__))
+            return False
 
-            if any(re.match(regex, entry.filename) for regex in ignore_regex):
+        def local_path_of(rel_path):
+            return os.path.join(local_dir, *rel_path.split('/'))
+
+        changed = {}
+        for rel_path, entry in remote_files.items():
+            if rel_path == MANIFEST_NAME:
+                continue
+            known = manifest.get(rel_path)
+            if known is not None and known[:2] == [entry.st_size, entry.st_mtime] and \
+                    _local_matches(local_path_of(rel_path), entry.st_size, entry.st_mtime):
                 continue
+            changed[rel_path] = entry
+
+        # same size, other mtime: compare the content before downloading
+        if checksum:
+            candidates = {rel_path: entry for rel_path, entry in changed.items() if rel_path in manifest
+                          and manifest[rel_path][2] and manifest[rel_path][0] == entry.st_size
+                          and _local_matches(local_path_of(rel_path), entry.st_size)}
+            remote_hashes = self._remote_sha256([remote_dir + remote_path_sep + p.replace('/', remote_path_sep)
+                                                 for p in candidates])
+            for rel_path, entry in candidates.items():
+                if remote_hashes.get(remote_dir + remote_path_sep + rel_path.replace('/', remote_path_sep)) \
+                        == manifest[rel_path][2]:
+                    os.utime(local_path_of(rel_path), (entry.st_mtime, entry.st_mtime))
+                    manifest[rel_path] = [entry.st_size, entry.st_mtime, manifest[rel_path][2]]
+                    del changed[rel_path]
+
+        rel_paths = {remote_dir + remote_path_sep + p.replace('/', remote_path_sep): p for p in changed}
+
+        def fetch(channel: paramiko.SFTPClient, remote_path: str) -> bool:
+            rel_path = rel_paths[remote_path]
+            local_path = local_path_of(rel_path)
+            try:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            except OSError as err:
+                logger.warning(MKDIR_LOCAL_ERROR.format(os.path.dirname(local_path)))
+                logger.warning(OS_ERROR.format(err))
+                return False
+            if not self._get_file(channel, remote_path, local_path):
+                return False
+            mtime = changed[rel_path].st_mtime
+            os.utime(local_path, (mtime, mtime))
+            return True
 
-            if self.is_dir(remote_path):
+        results = self._run_on_channels(fetch, list(rel_paths), parallelism)
+        for remote_path, fetched in results.items():
+            rel_path = rel_paths[remote_path]
+            if fetched:
+                entry = changed[rel_path]
+                manifest[rel_path] = [entry.st_size, entry.st_mtime,
+                                      _sha256_file(local_path_of(rel_path)) if checksum else None]
+            else:
+                manifest.pop(rel_path, None)
+
+        deleted = 0
+        success = all(results.values())
+        if mirror_deletions:
+            for rel_path in [p for p in manifest if p not in remote_files]:
                 try:
-                    os.mkdir(local_path)
+                    os.remove(local_path_of(rel_path))
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
                 except OSError as err:
-                    logger.warning(MKDIR_LOCAL_ERROR.format(local_path))
                     logger.warning(OS_ERROR.format(err))
-                    logger.warning(CONTINUING)
                     success = False
                     continue
-                self.copy_dir_from_remote(remote_path, local_path, remote_path_sep, ignore_regex)
-            elif self.is_file(remote_path):
-                success = self.copy_file_from_remote(remote_path, local_path) and success
+                del manifest[rel_path]
 
+        _write_manifest(manifest_path, manifest)
+        logger.info(SYNC_SUMMARY.format(remote_dir, local_dir, sum(results.values()),
+                                        len(remote_files) - len(changed), deleted,
+                                        len(results) - sum(results.values())))
         return success
 
+    def _walk_remote(self, remote_dir: str, remote_path_sep: str,
+                     ignore_regex: Iterable[re.Pattern] | Iterable[str],
+                     parallelism: int = DEFAULT_PARALLELISM) -> dict[str, paramiko.SFTPAttributes] | None:
+        """
+        Lists all regular files below a remote directory, skipping entries whose base name matches ignore_regex.
+        :return: {path relative to remote_dir with '/' as separator: attributes}. None, if a directory could not be
+                 listed.
+        """
+        files = {}
+
+        def list_dir(channel: paramiko.SFTPClient, rel_dir: str) -> list[tuple[str, bool]] | None:
+            remote_path = remote_dir + (remote_path_sep + rel_dir.replace('/', remote_path_sep) if rel_dir else '')
+            entries = self._list_remote_dir(channel, remote_path, remote_path_sep)
+            if entries is None:
+                return None
+            children = []
+            for entry in entries:
+                if any(re.match(regex, entry.filename) for regex in ignore_regex):
+                    continue
+                rel_path = rel_dir + '/' + entry.filename if rel_dir else entry.filename
+                if S_ISDIR(entry.st_mode):
+                    children.append((rel_path, True))
+                elif S_ISREG(entry.st_mode):
+                    files[rel_path] = entry
+            return children
+
+        if not self._walk_tree('', list_dir, lambda channel, rel_path: True, parallelism=parallelism):
+            return None
+        return files
+
+    def _remote_sha256(self, remote_paths: list[str]) -> dict[str, str]:
+        """
+        Hashes remote files with sha256sum, HASH_BATCH_SIZE files per command.
+        :return: {remote path: hex digest}. Files that could not be hashed are missing.
+        """
+        hashes = {}
+        for i in range(0, len(remote_paths), HASH_BATCH_SIZE):
+            batch = {_exec_path(path): path for path in remote_paths[i:i + HASH_BATCH_SIZE]}
+            result = self._exec('sha256sum -- ' + ' '.join(shlex.quote(path) for path in batch))
+            if result is None:
+                break
+            for line in result[1].decode(errors='replace').splitlines():
+                digest, _, path = line.partition('  ')
+                if path in batch and not digest.startswith('\\'):
+                    hashes[batch[path]] = digest
+        return hashes
+
     def copy_pattern_from_remote(self, remote_dir: str, local_dir: str, remote_regex: re.Pattern | str,
                                  remote_path_sep: str = DEFAULT_PATH_SEP) -> bool:
         """
@@ -279,17 +778,18 @@ class SftpApi:
         if not _create_local_dir(local_dir, self.copy_pattern_from_remote.__name__):
             return False
 
-        files = filter(lambda entry: re.match(remote_regex, entry.filename), sftp.listdir_attr(remote_dir))
-        remote_names_paths = map(lambda entry: (entry.filename, remote_dir + remote_path_sep + entry.filename), files)
-        remote_names_paths = filter(lambda name, path: self.is_file(path), remote_names_paths)
+        files = filter(lambda entry: re.match(remote_regex, entry.filename) and S_ISREG(entry.st_mode),
+                       self._listdir_attr(sftp, remote_dir, remote_path_sep))
 
         success = True
-        for file_name, remote_path in remote_names_paths:
-            success = self.copy_file_from_remote(remote_path, os.path.join(local_dir, file_name)) and success
+        for entry in files:
+            remote_path = remote_dir + remote_path_sep + entry.filename
+            success = self._get_file(sftp, remote_path, os.path.join(local_dir, entry.filename)) and success
         return success
 
     def copy_latest_pattern_from_remote(self, remote_dir: str, local_path: str, remote_regex: re.Pattern | str,
-                                        remote_path_sep: str = DEFAULT_PATH_SEP) -> bool:
+                                        remote_path_sep: str = DEFAULT_PATH_SEP,
+                                        since: (tuple[int, str] | None) = None) -> bool:
         """
         Copies the latest file on the remote system that matches the given regular expression to the local system.
         Logs a warning and returns False if no such file exists.
@@ -297,14 +797,13 @@ class SftpApi:
         :param local_path:      Destination path on the local system (including file name and ending!).
         :param remote_regex:    Regular expression for the file to be copied.
         :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param since:           Optional watermark, only files past it are considered.
         :return: True, if the operation was successful. False, if at least one Error has occurred.
         """
-        sftp = self._check_sftp(self.copy_latest_pattern_from_remote.__name__)
-        if sftp is None:
+        if self._check_sftp(self.copy_latest_pattern_from_remote.__name__) is None:
             return False
 
-        files = list(filter(lambda entry: re.match(remote_regex, entry.filename), sftp.listdir_attr(remote_dir)))
-        files.sort(key=lambda entry: entry.st_mtime)
+        files = self.list_pattern_on_remote(remote_dir, remote_regex, remote_path_sep, since)
 
         if len(files) == 0:
             logger.warning(NO_FILE_MATCHING_ERROR.format(remote_regex, remote_dir))
@@ -313,35 +812,423 @@ class SftpApi:
         remote_path = remote_dir + remote_path_sep + files[-1].filename
         return self.copy_file_from_remote(remote_path, local_path)
 
+    def list_pattern_on_remote(self, remote_dir: str, remote_regex: re.Pattern | str,
+                               remote_path_sep: str = DEFAULT_PATH_SEP,
+                               since: (tuple[int, str] | None) = None) -> list[paramiko.SFTPAttributes]:
+        """
+        Lists the entries in a given directory on the remote system that match the given regular expression, oldest
+        first. With a watermark only the files past it are listed. On remote systems with a POSIX shell and GNU find
+        they are filtered remotely, so the listing costs scale with the number of new files, otherwise the directory is
+        listed over SFTP and filtered locally.
+        :param remote_dir:      Path to the remote directory.
+        :param remote_regex:    Regular expression for the entries to be listed.
+        :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param since:           Optional watermark (modification time, file name), see listing_watermark.
+        :return: Attributes of the matching entries sorted by modification time and name. Empty, if not connected.
+        """
+        sftp = self._check_sftp(self.list_pattern_on_remote.__name__)
+        if sftp is None:
+            return []
+
+        entries = None
+        if since is not None and remote_path_sep == DEFAULT_PATH_SEP:
+            entries = self._find_newer(remote_dir, since[0])
+        if entries is None:
+            entries = self._listdir_attr(sftp, remote_dir, remote_path_sep)
+
+        files = [entry for entry in entries if re.match(remote_regex, entry.filename)
+                 and (since is None or listing_watermark([entry]) > tuple(since))]
+        files.sort(key=lambda entry: (entry.st_mtime, entry.filename))
+        return files
+
+    def _find_newer(self, remote_dir: str, mtime: int) -> list[paramiko.SFTPAttributes] | None:
+        """
+        Lists the files in a remote directory modified at or after the given time with one 'find -newermt' command.
+        :return: Attributes of the files with name, size and modification time set. None, if the command failed.
+        """
+        result = self._exec(f"find {_shell_path(remote_dir)} -maxdepth 1 -type f -newermt @{int(mtime) - 1} "
+                            f"-printf '%T@ %s %f\\0'")
+        if result is None or result[0] != 0:
+            return None
+
+        entries = []
+        for line in result[1].split(b'\0'):
+            if not line:
+                continue
+            entry = paramiko.SFTPAttributes()
+            mtime, size, name = line.decode(errors='replace').split(' ', 2)
+            entry.filename, entry.st_size, entry.st_mtime = name, int(size), int(float(mtime))
+            entries.append(entry)
+        return entries
+
+    def _exec(self, command: str, stdin: (bytes | None) = None) -> tuple[int, bytes] | None:
+        """
+        Runs a command on the remote system and waits for it to finish.
+        :param command: Shell command line.
+        :param stdin:   Optional bytes written to the standard input of the command.
+        :return: Tuple of the exit status and the standard output. None, if the command could not be run.
+        """
+        if self._ssh is None:
+            return None
+        try:
+            channel_stdin, stdout, stderr = self._ssh.exec_command(command)
+            if stdin is not None:
+                channel_stdin.write(stdin)
+            channel_stdin.channel.shutdown_write()
+            output = stdout.read()
+            status = stdout.channel.recv_exit_status()
+            if status != 0:
+                logger.info(EXEC_FAILED.format(command, status, stderr.read().decode(errors='replace').strip()))
+            return status, output
+        except paramiko.SSHException as err:
+            logger.warning(SSH_EXCEPTION.format(err))
+            return None
+
     def move_from_remote_by_pattern(self, remote_dir: str, local_path: str, remote_regex: re.Pattern | str,
-                                        remote_path_sep: str = DEFAULT_PATH_SEP) -> int:
+                                    remote_path_sep: str = DEFAULT_PATH_SEP,
+                                    parallelism: int = DEFAULT_PARALLELISM,
+                                    since: (tuple[int, str] | None) = None) -> int:
         """
-        Copies the latest file on the remote system that matches the given regular expression to the local system.
-        Logs a warning and returns False if no such file exists.
+        Moves all files in a given directory on the remote system that match the given regular expression to the given
+        local directory, oldest first. A remote file is only deleted after it has been copied successfully.
+        Logs a warning and returns 0 if no such file exists.
         :rtype: int:            Number of files moved from remote to local.
-        :param remote_dir:      Path to the remote directory with the file to be copied.
-        :param local_path:      Destination path on the local system (including file name and ending!).
-        :param remote_regex:    Regular expression for the file to be copied.
+        :param remote_dir:      Path to the remote directory with the files to be moved.
+        :param local_path:      Local destination directory.
+        :param remote_regex:    Regular expression for the files to be moved.
         :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param parallelism:     Number of SFTP channels transferring files concurrently.
+        :param since:           Optional watermark, only files past it are moved.
         """
-        sftp = self._check_sftp(self.move_from_remote_by_pattern.__name__)
-        if sftp is None:
-            return False
+        if self._check_sftp(self.move_from_remote_by_pattern.__name__) is None:
+            return 0
 
-        files = list(filter(lambda entry: re.match(remote_regex, entry.filename), sftp.listdir_attr(remote_dir)))
-        files.sort(key=lambda entry: entry.st_mtime)
+        files = self.list_pattern_on_remote(remote_dir, remote_regex, remote_path_sep, since)
 
         if not files:
             logger.warning(NO_FILE_MATCHING_ERROR.format(remote_regex, remote_dir))
-            return False
+            return 0
+
+        results = self.move_files_from_remote(
+            remote_paths=[remote_dir + remote_path_sep + f.filename for f in files],
+            local_dir=local_path,
+            parallelism=parallelism,
+        )
+        return sum(results.values())
+
+    def move_files_from_remote(self, remote_paths: Iterable[str], local_dir: str,
+                               parallelism: int = DEFAULT_PARALLELISM,
+                               transfer_mode: str = TRANSFER_MODE_SFTP,
+                               verify_checksum: bool = False) -> dict[str, bool]:
+        """
+        Moves the given remote files into the given local directory, preserving file names. A remote file is only deleted
+        after it has been copied successfully. With a parallelism greater than one the files are transferred
+        concurrently over several SFTP channels of the same SSH transport.
+        The copied files are deleted in one batch, see delete_files_on_remote.
+        With TRANSFER_MODE_TAR the files of each directory are fetched as one tar stream instead, which avoids the per
+        file SFTP overhead for many small files. Files on remote systems without tar are fetched over SFTP.
+        :param remote_paths:    Paths to the files on the remote system.
+        :param local_dir:       Local destination directory.
+        :param parallelism:     Number of SFTP channels transferring files concurrently.
+        :param transfer_mode:   TRANSFER_MODE_SFTP or TRANSFER_MODE_TAR.
+        :param verify_checksum: Compare the sha256 of every copy with a remote sha256sum before the remote file is
+                                deleted. Files that can not be hashed remotely are kept on the remote system.
+        :return: {remote path: True, if the file was moved. False, if an Error has occurred.}
+        """
+        remote_paths = list(remote_paths)
+        if self._check_sftp(self.move_files_from_remote.__name__) is None:
+            return dict.fromkeys(remote_paths, False)
+
+        if not _create_local_dir(local_dir, self.move_files_from_remote.__name__):
+            return dict.fromkeys(remote_paths, False)
+
+        def local_file_path_of(remote_path: str) -> str:
+            return os.path.abspath(os.path.join(local_dir, os.path.basename(remote_path)))
+
+        def get(sftp: paramiko.SFTPClient, remote_path: str) -> bool:
+            return self._get_file(sftp, remote_path, local_file_path_of(remote_path))
+
+        results = self._get_files_tar(remote_paths, local_dir) if transfer_mode == TRANSFER_MODE_TAR else {}
+        results.update(self._run_on_channels(get, [path for path in remote_paths if path not in results], parallelism))
+
+        if verify_checksum:
+            copied = [path for path, moved in results.items() if moved]
+            remote_hashes = self._remote_sha256(copied)
+            for remote_path in copied:
+                local_file_path = local_file_path_of(remote_path)
+                if remote_hashes.get(remote_path) != _sha256_file(local_file_path):
+                    logger.warning(CHECKSUM_MISMATCH.format(local_file_path, remote_path))
+                    os.remove(local_file_path)
+                    results[remote_path] = False
+        results.update(self.delete_files_on_remote([path for path, copied in results.items() if copied],
+                                                   parallelism=parallelism))
+        return results
+
+    def _get_files_tar(self, remote_paths: list[str], local_dir: str) -> dict[str, bool]:
+        """
+        Downloads remote files as one gzipped tar stream per remote directory, unpacked while it arrives. Only members
+        that have been requested and arrived with their full size count as downloaded.
+        :return: {remote path: True, if the file has been downloaded. False, otherwise}. Paths in directories for which
+                 tar could not be run on the remote system are missing.
+        """
+        by_dir = {}
+        for remote_path in remote_paths:
+            remote_dir, _, name = remote_path.rpartition(DEFAULT_PATH_SEP)
+            by_dir.setdefault(remote_dir or DEFAULT_PATH_SEP, {})[name] = remote_path
+
+        results = {}
+        for remote_dir, names in by_dir.items():
+            received = self._receive_tar(remote_dir, list(names), local_dir)
+            if received is not None:
+                results.update({remote_path: name in received for name, remote_path in names.items()})
+        return results
+
+    def _receive_tar(self, remote_dir: str, names: list[str], local_dir: str) -> set[str] | None:
+        """
+        Runs 'tar czf -' for the given files of a remote directory and unpacks the stream into the local directory.
+        :return: Names of the files received completely. None, if tar could not be run.
+        """
+        if self._ssh is None:
+            return None
+
+        wanted = set(names)
+        received = set()
+        error = None
+        try:
+            stdin, stdout, stderr = self._ssh.exec_command(f'tar czf - -C {_shell_path(remote_dir)} --null -T -')
+            stdin.write(b'\0'.join(name.encode() for name in names) + b'\0')
+            stdin.channel.shutdown_write()
+            with tarfile.open(fileobj=stdout, mode='r|gz') as tar:
+                for member in tar:
+                    name = member.name[2:] if member.name.startswith('./') else member.name
+                    if not member.isfile() or name not in wanted:
+                        continue
+                    local_path = os.path.join(local_dir, name)
+                    with tar.extractfile(member) as source, open(local_path + PARTIAL_SUFFIX, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                    if os.path.getsize(local_path + PARTIAL_SUFFIX) == member.size:
+                        os.replace(local_path + PARTIAL_SUFFIX, local_path)
+                        received.add(name)
+            status = stdout.channel.recv_exit_status()
+        except (tarfile.TarError, EOFError, OSError, paramiko.SSHException) as err:
+            error = err
+            status = None
+
+        if status != 0 or error is not None:
+            logger.warning(TAR_STREAM_ERROR.format(remote_dir, error or EXEC_FAILED.format('tar', status, '')))
+        if not received and status != 0:
+            return None
+        return received
+
+    def _run_on_channels(self, function, remote_paths: list[str], parallelism: int) -> dict[str, bool]:
+        """
+        Calls function(sftp, remote_path) for every remote path, spread over up to parallelism SFTP channels. Every
+        channel is used by one thread at a time.
+        :return: {remote path: return value of function}
+        """
+        if parallelism <= 1 or len(remote_paths) <= 1:
+            return {remote_path: function(self._sftp, remote_path) for remote_path in remote_paths}
+
+        with self._sftp_channels(min(parallelism, len(remote_paths))) as channels:
+            def run(remote_path: str):
+                sftp = channels.get()
+                try:
+                    return function(sftp, remote_path)
+                finally:
+                    channels.put(sftp)
 
-        for f in files:
-            path = remote_dir + remote_path_sep + f.filename
+            with ThreadPoolExecutor(max_workers=channels.qsize()) as executor:
+                return dict(zip(remote_paths, executor.map(run, remote_paths)))
 
-            self.copy_file_from_remote(path, local_path)
-            self.delete_file_on_remote(path)
+    @contextmanager
+    def _sftp_channels(self, number: int) -> Iterator[queue.Queue]:
+        """
+        Opens up to number - 1 additional SFTP channels on the current SSH transport and yields them together with the
+        main channel in a queue. The additional channels are closed on exit.
+        """
+        channels = queue.Queue()
+        channels.put(self._sftp)
+        extra_channels = []
+        transport = self._ssh.get_transport()
+        for _ in range(number - 1):
+            try:
+                extra_channels.append(paramiko.SFTPClient.from_transport(transport))
+            except paramiko.SSHException as err:
+                logger.warning(SSH_EXCEPTION.format(err))
+                logger.warning(OPEN_CHANNEL_ERROR.format(len(extra_channels) + 1))
+                break
+            channels.put(extra_channels[-1])
+        try:
+            yield channels
+        finally:
+            for channel in extra_channels:
+                channel.close()
 
-        return len(files)
+    def _walk_tree(self, root, list_dir, handle_file, enter_dir=None, leave_dir=None,
+                   parallelism: int = DEFAULT_PARALLELISM) -> bool:
+        """
+        Walks a directory tree breadth first, spread over up to parallelism SFTP channels. Every directory is listed as
+        soon as a channel is free, its files and subdirectories are queued right away, so listings and transfers of
+        different subtrees overlap instead of waiting for each other. Every callback gets the channel to use as its
+        first argument.
+        :param root:        Node of the root directory, e.g. its path.
+        :param list_dir:    list_dir(sftp, node) -> [(child node, True if the child is a directory)], None on error.
+        :param handle_file: handle_file(sftp, node) -> success of the file.
+        :param enter_dir:   Optional enter_dir(sftp, node) -> success, called before a directory is listed. Its
+                            subtree is skipped if it fails.
+        :param leave_dir:   Optional leave_dir(sftp, node) -> success, called once all entries of a directory have
+                            been handled, even if some of them failed.
+        :return: True, if every callback was successful. False, otherwise.
+        """
+        lock = threading.Lock()
+        done = threading.Event()
+        success = [True]
+        remaining = {}  # {directory node: entries not handled yet, +1 while it is being listed}
+        parents = {root: None}
+
+        with self._sftp_channels(max(parallelism, 1)) as channels, \
+                ThreadPoolExecutor(max_workers=channels.qsize()) as executor:
+
+            def entry_done(channel, directory, entry_success):
+                # counts one entry of directory as handled and leaves the directory once it was the last one
+                while True:
+                    with lock:
+                        success[0] = success[0] and entry_success
+                        remaining[directory] -= 1
+                        if remaining[directory]:
+                            return
+                        del remaining[directory]
+                        parent = parents.pop(directory)
+                    entry_success = leave_dir(channel, directory) if leave_dir else True
+                    if parent is None:
+                        with lock:
+                            success[0] = success[0] and entry_success
+                        done.set()
+                        return
+                    directory = parent
+
+            def visit_dir(channel, directory):
+                children = list_dir(channel, directory) if enter_dir is None or enter_dir(channel, directory) \
+                    else None
+                if children is None:
+                    with lock:
+                        success[0] = False
+                        parent = parents.pop(directory)
+                    if parent is None:
+                        done.set()
+                    else:
+                        entry_done(channel, parent, False)
+                    return
+                with lock:
+                    remaining[directory] = len(children) + 1
+                    for child, is_dir in children:
+                        if is_dir:
+                            parents[child] = directory
+                for child, is_dir in children:
+                    submit(visit_dir if is_dir else visit_file, child, directory)
+                entry_done(channel, directory, True)
+
+            def visit_file(channel, node, directory):
+                entry_done(channel, directory, handle_file(channel, node))
+
+            def run(function, *args):
+                channel = channels.get()
+                try:
+                    function(channel, *args)
+                except Exception as err:
+                    logger.warning(FUNCTION_ABORTED.format(f'{function.__name__}: {err}'))
+                    success[0] = False
+                    done.set()
+                finally:
+                    channels.put(channel)
+
+            def submit(function, node, directory=None):
+                if function is visit_dir:
+                    executor.submit(run, visit_dir, node)
+                else:
+                    executor.submit(run, visit_file, node, directory)
+
+            submit(visit_dir, root)
+            done.wait()
+        return success[0]
+
+    def _list_remote_dir(self, sftp: paramiko.SFTPClient, remote_dir: str,
+                         remote_path_sep: str = DEFAULT_PATH_SEP) -> list[paramiko.SFTPAttributes] | None:
+        """
+        _listdir_attr that logs errors instead of raising them.
+        :return: Attributes of the directory entries. None, if the directory could not be listed.
+        """
+        try:
+            return self._listdir_attr(sftp, remote_dir, remote_path_sep)
+        except IOError as err:
+            logger.warning(IO_ERROR.format(err))
+            logger.warning(CONTINUING)
+            return None
+
+    def _put_file(self, sftp: paramiko.SFTPClient, local_file_path: str, remote_path: str) -> bool:
+        """
+        Uploads a single local file over the given channel.
+        """
+        try:
+            sftp.put(localpath=local_file_path, remotepath=remote_path)
+        except (IOError, OSError) as err:
+            logger.warning(COPY_FROM_LOCAL_ERROR.format(local_file_path, remote_path))
+            logger.warning(IO_OS_ERROR.format(err))
+            return False
+        finally:
+            self._invalidate(remote_path)
+        return True
+
+    def _get_file(self, sftp: paramiko.SFTPClient, remote_path: str, local_file_path: str) -> bool:
+        """
+        Downloads a single remote file over the given channel in chunks into a partial file, which replaces
+        local_file_path once it has the size of the remote file. If a partial file of an interrupted download of the
+        same version of the remote file exists, the download resumes at its end. The size and mtime of the remote file
+        are kept next to the partial file to tell.
+        """
+        part_path = local_file_path + PARTIAL_SUFFIX
+        state_path = part_path + PARTIAL_STATE_SUFFIX
+        try:
+            with sftp.open(remote_path, 'rb') as remote_file:
+                attributes = remote_file.stat()
+                size = attributes.st_size
+                state = {'size': size, 'mtime': int(attributes.st_mtime or 0)}
+                offset = 0
+                if os.path.exists(part_path) and _read_partial_state(state_path) == state:
+                    offset = os.path.getsize(part_path)
+                if offset > size:
+                    offset = 0
+                if not offset:
+                    with open(state_path, 'w') as f:
+                        json.dump(state, f)
+                if offset < size:
+                    remote_file.seek(offset)
+                    remote_file.prefetch(size)
+                with open(part_path, 'ab' if offset else 'wb') as local_file:
+                    for data in iter(lambda: remote_file.read(TRANSFER_CHUNK_SIZE), b''):
+                        local_file.write(data)
+            if os.path.getsize(part_path) != size:
+                raise IOError(f'{os.path.getsize(part_path)} of {size} bytes received')
+            os.replace(part_path, local_file_path)
+            os.remove(state_path)
+        except (IOError, paramiko.SSHException) as err:
+            logger.warning(COPY_FROM_REMOTE_ERROR.format(remote_path, local_file_path))
+            logger.warning(IO_ERROR.format(err))
+            return False
+        return True
+
+    def _remove_file(self, sftp: paramiko.SFTPClient, remote_path: str) -> bool:
+        """
+        Deletes a single remote file over the given channel without checking its existence first.
+        """
+        try:
+            sftp.remove(path=remote_path)
+            self._invalidate(remote_path)
+        except IOError as err:
+            logger.warning(DELETE_FROM_REMOTE_ERROR.format(remote_path))
+            logger.warning(IO_ERROR.format(err))
+            return False
+        return True
 
     def delete_file_on_remote(self, remote_path: str) -> bool:
         """
@@ -358,17 +1245,67 @@ class SftpApi:
 
         try:
             sftp.remove(path=remote_path)
+            self._invalidate(remote_path)
         except IOError as err:
             logger.warning(DELETE_FROM_REMOTE_ERROR.format(remote_path))
             logger.warning(IO_ERROR.format(err))
             return False
         return True
 
-    def delete_dir_on_remote(self, remote_dir: str, remote_path_sep: str = DEFAULT_PATH_SEP) -> bool:
+    def delete_files_on_remote(self, remote_paths: Iterable[str], remote_path_sep: str = DEFAULT_PATH_SEP,
+                               parallelism: int = DEFAULT_PARALLELISM) -> dict[str, bool]:
+        """
+        Deletes the given files on the remote system in one batch. On remote systems with a POSIX shell a single
+        'xargs -0 rm -f' command deletes all of them and, if it fails, one listing of their directories tells which
+        files are left, those are removed over SFTP. Otherwise all files are removed over up to parallelism SFTP
+        channels. Files that do not exist count as deleted, unless their directory can not be listed after a failed
+        command.
+        :param remote_paths:    Paths to the files on the remote system.
+        :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param parallelism:     Number of SFTP channels used by the fallback.
+        :return: {remote path: True, if the file is gone. False, if an Error has occurred.}
         """
-        Recursively deletes a directory on the remote system.
+        remote_paths = list(remote_paths)
+        sftp = self._check_sftp(self.delete_files_on_remote.__name__)
+        if sftp is None or not remote_paths:
+            return dict.fromkeys(remote_paths, sftp is not None)
+
+        result = None
+        if remote_path_sep == DEFAULT_PATH_SEP:
+            result = self._exec('xargs -0 rm -f --', stdin=b'\0'.join(_exec_path(path).encode() for path in remote_paths))
+        if result is None:
+            return self._run_on_channels(
+                lambda channel, path: self._remove_file(channel, path) or self._stat(channel, path) is None,
+                remote_paths, parallelism)
+
+        for remote_path in remote_paths:
+            self._invalidate(remote_path)
+        if result[0] == 0:
+            return dict.fromkeys(remote_paths, True)
+
+        results = {}
+        for remote_dir in {path.rsplit(remote_path_sep, 1)[0] for path in remote_paths}:
+            dir_paths = [path for path in remote_paths if path.rsplit(remote_path_sep, 1)[0] == remote_dir]
+            try:
+                left = {remote_dir + remote_path_sep + entry.filename
+                        for entry in self._listdir_attr(sftp, remote_dir, remote_path_sep)}
+            except IOError:
+                left = set(dir_paths)
+            results.update({path: path not in left for path in dir_paths})
+
+        # e.g. xargs or rm missing or not allowed (exit status 126/127) in a restricted shell
+        left = [path for path, deleted in results.items() if not deleted]
+        results.update(self._run_on_channels(self._remove_file, left, parallelism))
+        return results
+
+    def delete_dir_on_remote(self, remote_dir: str, remote_path_sep: str = DEFAULT_PATH_SEP,
+                             parallelism: int = DEFAULT_PARALLELISM) -> bool:
+        """
+        Recursively deletes a directory on the remote system. Subdirectories are walked breadth first and deleted
+        concurrently, every directory is removed once its entries are gone.
         :param remote_dir:      Directory to be deleted.
         :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param parallelism:     Number of SFTP channels used concurrently.
         :return: True, if the operation was successful. False, if at least one Error has occurred.
         """
         sftp = self._check_sftp(self.delete_dir_on_remote.__name__)
@@ -378,38 +1315,48 @@ class SftpApi:
         if not self.exists(remote_dir):
             return True
 
-        success = True
-        for entry in sftp.listdir_attr(remote_dir):
-            remote_path = remote_dir + remote_path_sep + entry.filename
-            if self.is_dir(remote_path):
-                success = self.delete_dir_on_remote(remote_path, remote_path_sep) and success
-            elif self.is_file(remote_path):
-                success = self.delete_file_on_remote(remote_path) and success
-        sftp.rmdir(remote_dir)
-        return success
+        def list_dir(channel: paramiko.SFTPClient, remote_path: str) -> list[tuple[str, bool]] | None:
+            entries = self._list_remote_dir(channel, remote_path, remote_path_sep)
+            if entries is None:
+                return None
+            return [(remote_path + remote_path_sep + entry.filename, S_ISDIR(entry.st_mode))
+                    for entry in entries if S_ISDIR(entry.st_mode) or S_ISREG(entry.st_mode)]
+
+        def remove_dir(channel: paramiko.SFTPClient, remote_path: str) -> bool:
+            try:
+                channel.rmdir(remote_path)
+            except IOError as err:
+                logger.warning(DELETE_FROM_REMOTE_ERROR.format(remote_path))
+                logger.warning(IO_ERROR.format(err))
+                return False
+            finally:
+                self._invalidate(remote_path)
+            return True
+
+        return self._walk_tree(remote_dir, list_dir, self._remove_file, leave_dir=remove_dir, parallelism=parallelism)
 
     def delete_pattern_on_remote(self, remote_dir: str, remote_regex: re.Pattern | str,
-                                 remote_path_sep: str = DEFAULT_PATH_SEP) -> bool:
+                                 remote_path_sep: str = DEFAULT_PATH_SEP,
+                                 parallelism: int = DEFAULT_PARALLELISM) -> bool:
         """
-        Deletes all files in a given directory on the remote system that match the given regular expression.
+        Deletes all files in a given directory on the remote system that match the given regular expression in one
+        batch, see delete_files_on_remote.
         Note: Only considers the files in the given directory, not in any subdirectories.
         :param remote_dir:      Directory of the files to be deleted.
         :param remote_regex:    Regular expression for the files to be deleted.
         :param remote_path_sep: Path separator symbol ('/' for Linux/Unix/Mac, '\\' for Windows).
+        :param parallelism:     Number of SFTP channels used if the files can not be deleted with a shell command.
         :return: True, if the operation was successful. False, if at least one Error has occurred.
         """
         sftp = self._check_sftp(self.delete_pattern_on_remote.__name__)
         if sftp is None:
             return False
 
-        files = filter(lambda entry: re.match(remote_regex, entry.filename), sftp.listdir_attr(remote_dir))
+        files = filter(lambda entry: re.match(remote_regex, entry.filename) and S_ISREG(entry.st_mode),
+                       self._listdir_attr(sftp, remote_dir, remote_path_sep))
         file_paths = map(lambda entry: remote_dir + remote_path_sep + entry.filename, files)
-        file_paths = filter(lambda path: self.is_file(path), file_paths)
 
-        success = True
-        for file_path in file_paths:
-            success = self.delete_file_on_remote(file_path) and success
-        return success
+        return all(self.delete_files_on_remote(file_paths, remote_path_sep, parallelism).values())
 
     def exists(self, remote_path: str) -> bool:
         """
@@ -421,11 +1368,7 @@ class SftpApi:
         if sftp is None:
             return False
 
-        try:
-            sftp.stat(remote_path)
-        except IOError:
-            return False
-        return True
+        return self._stat(sftp, remote_path) is not None
 
     def is_file(self, remote_path: str) -> bool:
         """
@@ -437,11 +1380,8 @@ class SftpApi:
         if sftp is None:
             return False
 
-        try:
-            result = S_ISREG(sftp.stat(remote_path).st_mode)
-        except IOError:
-            result = False
-        return result
+        attributes = self._stat(sftp, remote_path)
+        return attributes is not None and S_ISREG(attributes.st_mode)
 
     def is_dir(self, remote_path: str) -> bool:
         """
@@ -453,11 +1393,123 @@ class SftpApi:
         if sftp is None:
             return False
 
+        attributes = self._stat(sftp, remote_path)
+        return attributes is not None and S_ISDIR(attributes.st_mode)
+
+    def clear_cache(self):
+        """
+        Drops all cached stat and listing results.
+        """
+        with self._cache_lock:
+            self._stat_cache.clear()
+            self._listdir_cache.clear()
+
+    def _stat(self, sftp: paramiko.SFTPClient, remote_path: str) -> paramiko.SFTPAttributes | None:
+        """
+        Stats a remote path, served from the cache if enabled.
+        :return: Attributes of the remote path. None, if it does not exist.
+        """
+        if self.cache_ttl:
+            with self._cache_lock:
+                cached = self._stat_cache.get(remote_path)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+
         try:
-            result = S_ISDIR(sftp.stat(remote_path).st_mode)
+            attributes = sftp.stat(remote_path)
         except IOError:
-            result = False
-        return result
+            attributes = None
+
+        if self.cache_ttl:
+            with self._cache_lock:
+                self._stat_cache[remote_path] = (time.monotonic() + self.cache_ttl, attributes)
+        return attributes
+
+    def _listdir_attr(self, sftp: paramiko.SFTPClient, remote_dir: str,
+                      remote_path_sep: str = DEFAULT_PATH_SEP) -> list[paramiko.SFTPAttributes]:
+        """
+        Lists a remote directory with the attributes of its entries, served from the cache if enabled. The entries
+        also fill the stat cache, so following exists/is_file/is_dir checks need no round trip.
+        """
+        if self.cache_ttl:
+            with self._cache_lock:
+                cached = self._listdir_cache.get(remote_dir)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+
+        entries = sftp.listdir_attr(remote_dir)
+
+        if self.cache_ttl:
+            expires = time.monotonic() + self.cache_ttl
+            with self._cache_lock:
+                self._listdir_cache[remote_dir] = (expires, entries)
+                for entry in entries:
+                    self._stat_cache[remote_dir + remote_path_sep + entry.filename] = (expires, entry)
+        return entries
+
+    def _invalidate(self, remote_path: str):
+        """
+        Drops the cached results of a remote path that has been written or deleted, including the listing of its parent
+        directory.
+        """
+        if not self.cache_ttl:
+            return
+        sep_index = max(remote_path.rfind('/'), remote_path.rfind('\\'))
+        parent = remote_path[:max(sep_index, 1)] if sep_index >= 0 else ''
+        with self._cache_lock:
+            self._stat_cache.pop(remote_path, None)
+            self._listdir_cache.pop(remote_path, None)
+            self._listdir_cache.pop(parent, None)
+
+    def watch_dir(self, remote_dir: str, remote_regex: re.Pattern | str, poll_interval: int = 5,
+                  timeout: (float | None) = None) -> Iterator[str | None]:
+        """
+        Watches a directory on the remote system over a long running exec channel and yields the names of files that
+        match the given regular expression as they are written. Uses inotifywait if it is installed on the remote
+        system and a portable 'find -newer' loop otherwise, which reports files poll_interval seconds after their last
+        modification. Only works with a POSIX shell on the remote system.
+        :param remote_dir:    Path to the remote directory.
+        :param remote_regex:  Regular expression for the file names to be reported.
+        :param poll_interval: Seconds between two checks of the find fallback.
+        :param timeout:       Seconds after which None is yielded if no file has been reported, None waits forever.
+        :return: Names of the new files. None after timeout seconds without an event. Stops when the channel closes.
+        """
+        if self._check_sftp(self.watch_dir.__name__) is None:
+            return
+
+        directory = _shell_path(remote_dir)
+        command = (
+            'if command -v inotifywait >/dev/null 2>&1; then '
+            f'exec inotifywait -m -q -e close_write -e moved_to --format %f {directory}; '
+            'fi; '
+            f'm=$(mktemp) && trap \'rm -f "$m" "$m.next"\' EXIT && cd {directory} && '
+            f'while :; do touch "$m.next"; sleep {int(poll_interval)}; '
+            'find . -maxdepth 1 -type f -newer "$m" ! -newer "$m.next" -print; mv -f "$m.next" "$m"; done'
+        )
+
+        channel = self._ssh.get_transport().open_session()
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            buffer = b''
+            while True:
+                try:
+                    data = channel.recv(4096)
+                except socket.timeout:
+                    if not channel.get_transport().is_active():
+                        break
+                    yield None
+                    continue
+                if not data:
+                    break
+                *lines, buffer = (buffer + data).split(b'\n')
+                for line in lines:
+                    name = os.path.basename(line.decode(errors='replace').strip())
+                    if name and re.match(remote_regex, name):
+                        yield name
+            logger.warning(WATCH_ENDED.format(remote_dir, channel.recv_exit_status()))
+        finally:
+            channel.close()
 
     def get_ssh(self) -> paramiko.SSHClient | None:
         """
@@ -1,22 +1,26 @@
-import os
+import mimetypes
 
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.http import HttpResponseRedirect, FileResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import method_decorator
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.generic import FormView, DetailView, ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django_celery_beat.models import PeriodicTasks, CrontabSchedule, PeriodicTask
 
 from dashboard_racks import settings
 from .filters import ReportFilter
 from .forms import CreateRackForm, UpdateRackForm, UpdateSshConfigForm, UpdateReportConfigForm, ReportFilterForm
-from .models import Rack, SshConfig, ReportConfig, Report
-from .utils.paramiko_wrapper import SftpApi, sftp_instances, get_sftp_instance_by_hostname
-from .tasks import print_message
-from collections import namedtuple
+from .models import Rack, SshConfig, ReportConfig, Report, ReportArchive, ReportBlob
+from .counts import get_report_count, invalidate_report_counts
+from .pagination import keyset_paginate
+from .search import search_reports
+from .storage import content_encoding, open_decompressed
+from .report_parsers import guess_verdict
+from .snapshots import get_remote_listing, is_stale, request_refresh, RemoteReport
 
 
 # Create your views here.
@@ -31,7 +35,7 @@ class FilteredListView(ListView):
         # on the view instance for later.
         self.filterset = self.filterset_class(self.request.GET, queryset=queryset, request=self.request)
         # Return the filtered queryset
-        return self.filterset.qs.distinct()
+        return self.filterset.qs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -104,6 +108,11 @@ class RackUpdateView(UpdateView):
                 initial={
                     'remote_report_path': rack.report_config.remote_report_path,
                     'pull_reports_time': rack.report_config.pull_reports_time,
+                    'adaptive_polling': rack.report_config.adaptive_polling,
+                    'min_poll_interval': rack.report_config.min_poll_interval,
+                    'max_poll_interval': rack.report_config.max_poll_interval,
+                    'watch_mode': rack.report_config.watch_mode,
+                    'transfer_mode': rack.report_config.transfer_mode,
                 })
 
         return context
@@ -152,21 +161,12 @@ class RackUpdateView(UpdateView):
 
     # TODO Rename this here and in `post`
     def _extracted_from_post_34(self, form):
-        print_message.delay("Hello World")
-
-        if not self.object.report_config.contrab_schedule:
-            crontab = CrontabSchedule.objects.create()
-            periodic_task_obj = PeriodicTask.objects.create(name=f'periodict_task_{self.object}',
-                                                            task='pull_reports_task', crontab=crontab, enabled=True)
-            self.object.report_config.contrab_schedule = crontab
-        else:
-            crontab = self.object.report_config.contrab_schedule
-
-        crontab.minute = form.cleaned_data['pull_reports_time'].minute
-        crontab.hour = form.cleaned_data['pull_reports_time'].hour
-        crontab.save()
-        PeriodicTasks.update_changed()
-        self.object.report_config.save()
+        if isinstance(form, self.report_config_form_class):
+            report_config: ReportConfig = form.instance
+            report_config.poll_interval = min(max(report_config.poll_interval, report_config.min_poll_interval),
+                                              report_config.max_poll_interval)
+            report_config.next_pull_at = report_config.get_next_pull_at()
+            report_config.drop_legacy_schedule()
         return self.form_valid(form)
 
 
@@ -180,42 +180,24 @@ class RackDetailView(DetailView):
     def get_context_data(self, **kwargs):
         reports = []
         context = super(RackDetailView, self).get_context_data()
-        ssh_config: SshConfig = self.object.ssh_config
-        report_config: ReportConfig = self.object.report_config
-
-        sftp_api = get_sftp_instance_by_hostname(
-            hostname=ssh_config.hostname,
-            username=ssh_config.username,
-            password=ssh_config.password,
-            private_key=ssh_config.private_key.path if ssh_config.private_key else '',
-            port=ssh_config.port,
-        )
-
-        try:
-            if not sftp_api.is_connected:
-                sftp_api.connect()
-
-            sftp = sftp_api.get_sftp()
-            reports = [x for x in sftp.listdir(self.object.report_config.remote_report_path) if x.endswith('.html')]
-
-            remote_report_collection = []
-            Report = namedtuple('report', ['name', 'tag'])
-            _err_cnt = 0
-            for r in reports:
-                _tag = 'success'
-                if 'error' in r.lower():
-                    _tag = 'danger'
-                    _err_cnt += 1
-                remote_report_collection.append(Report(r, _tag))
-
-            context['remote_reports_failed'] = _err_cnt
-            context['remote_reports_passed'] = len(remote_report_collection) - _err_cnt
-            context['remote_report_collection'] = remote_report_collection
-
-        except Exception as ex:
-            messages.success(self.request, f"Failed to connect to {self.object.ssh_config.hostname}",
-                             extra_tags='danger')
-            messages.success(self.request, f"Error message: {str(ex)}", extra_tags='danger')
+        snapshot = get_remote_listing(self.object)
+
+        if is_stale(snapshot) and (snapshot is None or settings.REMOTE_LISTING_REFRESH_ON_VIEW):
+            context['remote_listing_refreshing'] = request_refresh(self.object)
+
+        if snapshot is not None:
+            reports = snapshot['reports']
+            context['remote_report_collection'] = [
+                RemoteReport(r, 'danger' if guess_verdict(r) == 'FAILED' else 'success') for r in reports
+            ]
+            context['remote_reports_failed'] = snapshot['failed']
+            context['remote_reports_passed'] = snapshot['passed']
+            context['remote_listing_fetched_at'] = snapshot['fetched_at']
+
+            if snapshot['error']:
+                messages.success(self.request, f"Failed to connect to {self.object.ssh_config.hostname}",
+                                 extra_tags='danger')
+                messages.success(self.request, f"Error message: {snapshot['error']}", extra_tags='danger')
 
         if reports:
             context['reports'] = reports
@@ -274,23 +256,90 @@ class ReportDetailView(DetailView):
         return context
 
 
+class ReportFileView(DetailView):
+    """
+    Serves the stored report file. Compressed reports are sent as they are stored if the client accepts their content
+    coding and are decompressed on the fly otherwise.
+    """
+    model = Report
+
+    def render_to_response(self, context, **response_kwargs):
+        report: Report = self.object
+        storage = report.file.storage
+        encoding = content_encoding(report.file.name)
+        content_type = mimetypes.guess_type(report.name)[0] or 'text/html'
+
+        if encoding is None or encoding in _accepted_encodings(self.request):
+            response = FileResponse(storage.open(report.file.name, 'rb'), content_type=content_type)
+            if encoding is not None:
+                response['Content-Encoding'] = encoding
+        else:
+            f = open_decompressed(storage, report.file.name)
+            response = StreamingHttpResponse(_read_chunks(f), content_type=content_type)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+def _accepted_encodings(request):
+    encodings = set()
+    for coding in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def _read_chunks(f, chunk_size=64 * 1024):
+    try:
+        yield from iter(lambda: f.read(chunk_size), b'')
+    finally:
+        f.close()
+
+
 class ReportFilteredListView(FilteredListView):
+    """
+    Lists the filtered reports of a rack page by page with keyset pagination on (created, pk), see keyset_paginate.
+    Searched reports are listed by relevance instead, only the best page_size matches are shown.
+    """
     model = Report
     filterset_class = ReportFilter
     template_name = "app/rack_report_list_filtered.html"
-    paginate_by = 250
+    page_size = 250
 
     def get_context_data(self, **kwargs):
         context = super(ReportFilteredListView, self).get_context_data(**kwargs)
         rack = get_object_or_404(Rack, pk=self.kwargs.get('rack_pk', None))
         context['rack'] = rack
 
+        context['report_count'] = get_report_count(rack.archive, self.filterset)
+        if self.filterset.search_query:
+            context['reports'] = search_reports(self.object_list, self.filterset.search_query, self.page_size)
+            return context
+
+        page = keyset_paginate(self.object_list, self.page_size,
+                               after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        context['reports'] = page.items
+        context['next_query'] = self._page_query('after', page.next_token)
+        context['prev_query'] = self._page_query('before', page.prev_token)
+
         # for report in rack.archive.reports.all():
         #     report.verdict = 'FAILED' if 'error' in report.name.lower() else 'PASSED'
         #     report.save()
 
         return context
 
+    def _page_query(self, key, token):
+        """
+        :return: Query string of the current filter with the given page token. None, if there is no token.
+        """
+        if token is None:
+            return None
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[key] = token
+        return query.urlencode()
+
 
 class ReportDeleteView(DeleteView):
     model = Report
@@ -299,8 +348,11 @@ class ReportDeleteView(DeleteView):
     def form_valid(self, form):
         success_url = self.get_success_url()
         report: Report = self.object
-        os.remove(os.path.abspath(os.path.join(os.path.join(settings.MEDIA_ROOT, report.file.name))))
-        report.delete()
+        with transaction.atomic():
+            ReportBlob.remove_references([report.file.name])
+            report.delete()
+            ReportArchive.remove_from_stats([report])
+            transaction.on_commit(lambda: invalidate_report_counts(report.archive_id))
         return HttpResponseRedirect(success_url)
 
     def get_success_url(self):
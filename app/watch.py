@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+
+from django import db
+from django.core.cache import cache
+from django.utils import timezone
+
+from dashboard_racks import settings
+from .ingest import REPORT_PATTERN, start_archive_job
+from .models import Rack, ReportConfig
+from .utils.paramiko_wrapper import sftp_instance
+
+WATCH_HEARTBEAT_KEY = 'rack-watch-{0}'
+WATCH_FAILED = "Watch of rack '{0}' failed: {1}"
+WATCH_STOPPED = "Watch of rack '{0}' stopped, falling back to polling."
+
+logger = logging.getLogger('watch')
+
+
+def get_watched_racks(rack_pks):
+    """
+    :return: Set of the given rack pks whose watch is running, judged by its heartbeat.
+    """
+    keys = {WATCH_HEARTBEAT_KEY.format(rack_pk): rack_pk for rack_pk in rack_pks}
+    return {keys[key] for key in cache.get_many(keys)}
+
+
+def _beat(rack_pk):
+    cache.set(WATCH_HEARTBEAT_KEY.format(rack_pk), timezone.now().isoformat(), timeout=settings.WATCH_HEARTBEAT_TIMEOUT)
+
+
+def watch_rack(rack: Rack, stop: threading.Event):
+    """
+    Watches the remote report directory of the rack until stop is set or the watch fails and queues the archiving of
+    new reports in batches. While the watch runs, its heartbeat keeps dispatch_due_pulls_task from polling the rack.
+    Once it stops, the heartbeat is removed and the rack is due for a pull right away, so polling takes over.
+    """
+    from .tasks import archive_report_files_task
+
+    pending = []
+    flush_at = None
+    try:
+        with sftp_instance(**rack.ssh_config.get_connection_kwargs()) as sftp_api:
+            _beat(rack.pk)
+            # reports written before the watch started
+            start_archive_job(rack)
+
+            for name in sftp_api.watch_dir(rack.report_config.remote_report_path, REPORT_PATTERN,
+                                           poll_interval=settings.WATCH_POLL_INTERVAL,
+                                           timeout=settings.WATCH_BATCH_DELAY):
+                if stop.is_set():
+                    break
+                _beat(rack.pk)
+                if name is not None:
+                    pending.append(name)
+                    flush_at = flush_at or time.monotonic() + settings.WATCH_BATCH_DELAY
+                if pending and time.monotonic() >= flush_at:
+                    archive_report_files_task.delay(rack.pk, pending)
+                    pending, flush_at = [], None
+    except Exception as ex:
+        logger.warning(WATCH_FAILED.format(rack.name, ex))
+    finally:
+        cache.delete(WATCH_HEARTBEAT_KEY.format(rack.pk))
+        ReportConfig.objects.filter(pk=rack.report_config_id).update(next_pull_at=timezone.now())
+        logger.info(WATCH_STOPPED.format(rack.name))
+        db.connection.close()
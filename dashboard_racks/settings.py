@@ -178,6 +178,60 @@ RECAPTCHA_PRIVATE_KEY = '6LfakhUiAAAAAHbXVCOp6vDc_DLJ3aJ4MujgXfMn'
 X_FRAME_OPTIONS = 'SAMEORIGIN'
 
 
+# SFTP settings
+SFTP_TRANSFER_PARALLELISM = 4  # concurrent SFTP channels per rack when moving reports
+SFTP_VERIFY_CHECKSUM = False  # compare a remote sha256sum with every copied report before it is deleted on the rack
+
+# Report archiving jobs
+ARCHIVE_JOB_TIMEOUT = 60 * 60  # seconds an archive job id is remembered per rack
+ARCHIVE_PROGRESS_CHUNK_SIZE = 50  # files handled between two progress updates
+INGEST_BULK_SIZE = 500  # reports inserted per bulk_create
+REPORT_COMPRESSION = 'gzip'  # 'gzip', 'zstd' (needs the zstandard package) or None to store reports uncompressed
+REPORT_PARSERS = [  # tried in order, the first parser accepting a report parses it at ingest
+    'app.report_parsers.PytestHtmlParser',
+    'app.report_parsers.GenericHtmlParser',
+]
+REPORT_SEARCH_MAX_TEXT = 200000  # characters of report text kept in the full-text search index per report
+
+# Scheduled pulls of all racks
+PULL_MAX_CONCURRENT_RACKS = 8  # racks archived at the same time
+PULL_MAX_CONCURRENT_PER_HOST = 1  # racks archived at the same time per SSH host and port
+PULL_RACK_TIME_LIMIT = 30 * 60  # seconds one rack may take before its pull is aborted
+PULL_SLOT_RETRY_COUNTDOWN = 10  # seconds between attempts to get a free pull slot
+PULL_SLOT_MAX_RETRIES = 360
+PULL_DISPATCH_INTERVAL = 60  # seconds between two checks for racks that are due to be pulled
+
+# Adaptive polling of racks with ReportConfig.adaptive_polling
+ADAPTIVE_POLL_MIN_INTERVAL = 5 * 60  # default minimum seconds between two pulls of a rack
+ADAPTIVE_POLL_MAX_INTERVAL = 24 * 60 * 60  # default maximum seconds between two pulls of a rack
+ADAPTIVE_POLL_TARGET_BATCH = 50  # reports a busy rack should have queued when it is pulled
+ADAPTIVE_POLL_BACKOFF = 2  # factor the interval grows by after an empty or failed pull
+ADAPTIVE_POLL_RATE_SMOOTHING = 0.3  # weight of the latest pull in the arrival rate estimate
+
+# Watch mode of racks with ReportConfig.watch_mode, run by the watch_reports management command
+WATCH_POLL_INTERVAL = 5  # seconds between two checks on remote systems without inotifywait
+WATCH_BATCH_DELAY = 2  # seconds new reports are collected before their archiving is queued
+WATCH_HEARTBEAT_TIMEOUT = 60  # seconds after which a silent watch is considered down and the rack is polled again
+WATCH_RESTART_DELAY = 60  # seconds between a watch going down and the next attempt to start it
+WATCH_FILES_MAX_RETRIES = 30  # attempts to archive reported files while another archive job of the rack runs
+
+# Report counts of the filtered report list
+REPORT_COUNT_CACHE_TIMEOUT = 10 * 60  # seconds a filtered count is cached, changes of the archive drop it earlier
+REPORT_COUNT_EXACT_LIMIT = 100000  # archives with more reports get capped or estimated filtered counts
+
+# Cache shared by the web and celery worker processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
+# Remote report listing snapshots shown on the rack detail page
+REMOTE_LISTING_MAX_AGE = 300  # seconds after which a snapshot is considered stale
+REMOTE_LISTING_REFRESH_ON_VIEW = True  # queue a refresh when a stale snapshot is viewed
+REMOTE_LISTING_FULL_INTERVAL = 24 * 60 * 60  # seconds between two complete listings, others only list past the watermark
+
 # Celery settings
 CELERY_BROKER_URL = "redis://localhost:6379"
 CELERY_RESULT_BACKEND = "redis://localhost:6379"
@@ -187,5 +241,15 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = "Europe/Berlin"
 CELERY_ALWAYS_EAGER = True
+CELERY_BEAT_SCHEDULE = {
+    'refresh-remote-listings': {
+        'task': 'refresh_remote_listings_task',
+        'schedule': REMOTE_LISTING_MAX_AGE,
+    },
+    'dispatch-due-pulls': {
+        'task': 'dispatch_due_pulls_task',
+        'schedule': PULL_DISPATCH_INTERVAL,
+    },
+}
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'